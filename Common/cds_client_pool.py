@@ -0,0 +1,90 @@
+#%% Pool of reusable CDS clients shared by the EFAS and SEAS5 downloaders. Every request
+# is timed and appended to a JSON-lines log: queue wait, transfer time, bytes and MB/s
+
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import cdsapi
+
+TELEMETRY_NAME = 'cds_requests.jsonl'
+
+class ClientPool:
+    """
+    Hands out up to size persistent clients and logs the timing of every request made through them.
+    """
+    def __init__(self, size=1, log_path=None, client_factory=cdsapi.Client):
+        self.size = size
+        self.log_path = None if log_path is None else str(log_path)
+        self.client_factory = client_factory
+        self._clients = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def client(self):
+        """
+        Borrow a client, creating one while fewer than size exist, otherwise wait for a free one.
+        """
+        with self._lock:
+            if self._clients.empty() and self._created < self.size:
+                self._clients.put(self.client_factory())
+                self._created += 1
+        c = self._clients.get()
+        try:
+            yield c
+        finally:
+            self._clients.put(c)
+
+    def retrieve(self, dataset, request, target):
+        """
+        Submit a request, wait for the CDS to finish it and download the result to target.
+        """
+        record = {'dataset': dataset, 'target': os.path.basename(str(target)),
+                  'started_at': datetime.now().isoformat(timespec='seconds')}
+        with self.client() as c:
+            start_time = time.perf_counter()
+            try:
+                # Without a target the CDS client returns once the job is done, which splits
+                # the time spent waiting in the queue from the time spent downloading
+                result = c.retrieve(dataset, request)
+                queued_time = time.perf_counter()
+                result.download(str(target))
+                finished_time = time.perf_counter()
+            except Exception as e:
+                record.update(status='failed', error=str(e), elapsed_s=round(time.perf_counter() - start_time, 3))
+                self._log(record)
+                raise
+
+        size = os.path.getsize(target)
+        transfer_time = finished_time - queued_time
+        record.update(
+            status='completed',
+            queue_wait_s=round(queued_time - start_time, 3),
+            transfer_s=round(transfer_time, 3),
+            bytes=size,
+            mb_per_s=round(size / 1e6 / transfer_time, 3) if transfer_time > 0 else None,
+        )
+        self._log(record)
+        return target
+
+    def _log(self, record):
+        if self.log_path is None:
+            return
+        with self._lock, open(self.log_path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+_shared_pool = None
+
+def shared_pool(size=1, log_path=None):
+    """
+    Process-wide pool, created on the first call and reused by every later one.
+    """
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = ClientPool(size, log_path)
+    return _shared_pool
@@ -0,0 +1,100 @@
+#%% Shared on-disk manifest of finished CDS downloads, used by the EFAS and SEAS5 downloaders
+# so that a rerun only fetches the months that are missing or were cut off mid-transfer
+
+import hashlib
+import json
+import os
+import threading
+import zipfile
+
+MANIFEST_NAME = 'download_manifest.json'
+
+def request_hash(dataset, request):
+    """
+    Hash of the dataset name and request parameters, independent of key order.
+    """
+    payload = json.dumps([dataset, request], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def file_checksum(path, chunk_size=8 * 1024 * 1024):
+    """
+    SHA-256 of a file, read in chunks so large GRIB files do not need to fit in memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def looks_complete(path, extension=None):
+    """
+    Cheap structural check that catches zip, GRIB and NetCDF files truncated during download.
+    The file type is taken from the extension unless given, e.g. for temporary '.part' files.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return False
+
+    if extension is None:
+        extension = os.path.splitext(path)[1].lower()
+    if extension == '.zip':
+        # The central directory sits at the end of the archive, so a cut-off zip fails here
+        return zipfile.is_zipfile(path)
+
+    with open(path, 'rb') as f:
+        head = f.read(8)
+        if extension == '.grib':
+            # Every GRIB message starts with 'GRIB' and ends with '7777'
+            f.seek(-4, os.SEEK_END)
+            return head[:4] == b'GRIB' and f.read(4) == b'7777'
+        if extension == '.nc':
+            return head[:3] == b'CDF' or head == b'\x89HDF\r\n\x1a\n'
+    return True
+
+class DownloadManifest:
+    """
+    JSON record of completed requests keyed by output file name, with parameters hash, size and checksum.
+    """
+    def __init__(self, manifest_path):
+        self.manifest_path = str(manifest_path)
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r') as f:
+                self.entries = json.load(f)
+
+    def is_complete(self, path, dataset, request, verify_checksum=False):
+        """
+        True when the file was recorded for these parameters and is still intact on disk.
+        By default only sizes are compared so that a rerun on a full archive takes seconds.
+        """
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None or entry['params_hash'] != request_hash(dataset, request):
+            return False
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        if not looks_complete(path):
+            return False
+        if verify_checksum and file_checksum(path) != entry['checksum']:
+            return False
+        return True
+
+    def record(self, path, dataset, request):
+        """
+        Add or replace the entry for a finished file and save the manifest.
+        """
+        entry = {
+            'dataset': dataset,
+            'params_hash': request_hash(dataset, request),
+            'size': os.path.getsize(path),
+            'checksum': file_checksum(path),
+        }
+        with self._lock:
+            self.entries[os.path.basename(path)] = entry
+            self._save()
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a half-written manifest
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.manifest_path)
@@ -0,0 +1,186 @@
+#%% Consolidated archive of the monthly EFAS NetCDF files. The monthly files are chunked
+# for map access, while every consumer here reads long series at a few points, so the
+# archive stores dis06/dis24 in one NetCDF4 file chunked along time per spatial tile.
+# New months are appended incrementally, months already in the archive are skipped.
+
+import logging
+import os
+
+import netCDF4 as nc
+import numpy as np
+
+from station_index import grid_signature
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TILE = 8  # Grid cells per chunk along y and x
+HISTORICAL_TIME_CHUNK = 4 * 365 * 2  # Two years of 6-hourly steps per chunk
+REFORECAST_INIT_CHUNK = 12  # One year of monthly initialisations per chunk
+CHUNK_CACHE_SIZE = 64 * 1024 * 1024
+
+def _copy_attributes(src_var, dst_var):
+    dst_var.setncatts({attr: src_var.getncattr(attr) for attr in src_var.ncattrs() if attr != '_FillValue'})
+
+def _create_raw(archive, *args, **kwargs):
+    # Dataset.set_auto_maskandscale only reaches variables that exist already, a new variable would
+    # otherwise scale the packed values written to it
+    var = archive.createVariable(*args, **kwargs)
+    var.set_auto_maskandscale(False)
+    return var
+
+def _check_round_trip(out_var, written, values, file_path):
+    # The packed values read back from the archive must be the ones of the source file
+    stored = out_var[written]
+    equal_nan = np.issubdtype(stored.dtype, np.floating)
+    if not np.array_equal(stored, values, equal_nan=equal_nan):
+        raise ValueError(f"Archived values of {file_path} differ from the source file")
+
+def _fill_value(var):
+    return var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+
+def _copy_coordinates(src, archive, spatial_dims):
+    # Latitude/longitude are either 1-D axes or 2-D fields on the spatial dimensions
+    for dim in spatial_dims:
+        archive.createDimension(dim, len(src.dimensions[dim]))
+    for name in ('latitude', 'longitude'):
+        var = src.variables[name]
+        out_var = _create_raw(archive, name, var.datatype, var.dimensions, fill_value=_fill_value(var))
+        _copy_attributes(var, out_var)
+        out_var[:] = var[:]
+    archive.setncattr('grid_signature', grid_signature(src))
+
+def _check_grid(archive, src, file_path):
+    if grid_signature(src) != archive.getncattr('grid_signature'):
+        raise ValueError(f"Grid of {file_path} differs from the archive grid")
+
+def _spatial_chunks(archive, spatial_dims, tile):
+    return [min(tile, len(archive.dimensions[dim])) for dim in spatial_dims]
+
+def append_historical(file_paths, archive_path, tile=DEFAULT_TILE, time_chunk=HISTORICAL_TIME_CHUNK):
+    """
+    Append the 6-hourly dis06 of monthly historical files, in chronological order, to the archive.
+    Time steps at or before the last one already in the archive are skipped.
+    """
+    with nc.Dataset(archive_path, 'a' if os.path.exists(archive_path) else 'w', format='NETCDF4') as archive:
+        archive.set_auto_maskandscale(False)
+        for file_path in file_paths:
+            with nc.Dataset(file_path) as src:
+                src.set_auto_maskandscale(False)
+                src_var = src.variables['dis06']
+                src_time = src.variables['time']
+
+                created = 'dis06' not in archive.variables
+                if created:
+                    spatial_dims = src_var.dimensions[1:]
+                    _copy_coordinates(src, archive, spatial_dims)
+                    archive.createDimension('time', None)
+                    time_var = _create_raw(archive, 'time', 'f8', ('time',))
+                    time_var.units = src_time.units
+                    time_var.calendar = getattr(src_time, 'calendar', 'standard')
+                    out_var = _create_raw(archive, 'dis06', src_var.datatype, ('time',) + spatial_dims, zlib=True,
+                                          chunksizes=[time_chunk] + _spatial_chunks(archive, spatial_dims, tile),
+                                          fill_value=_fill_value(src_var))
+                    _copy_attributes(src_var, out_var)
+                _check_grid(archive, src, file_path)
+
+                # Express the file's times in the archive units before comparing them
+                time_var = archive.variables['time']
+                dates = nc.num2date(src_time[:], units=src_time.units, calendar=getattr(src_time, 'calendar', 'standard'))
+                times = np.asarray(nc.date2num(dates, units=time_var.units, calendar=time_var.calendar), dtype=float)
+                start = len(time_var)
+                new_steps = np.flatnonzero(times > time_var[start - 1]) if start else np.arange(times.size)
+                if new_steps.size == 0:
+                    logger.info(f"Already in the archive, skipping {file_path}")
+                    continue
+
+                first = new_steps[0]
+                written = slice(start, start + times.size - first)
+                values = src_var[first:]
+                time_var[written] = times[first:]
+                archive.variables['dis06'][written] = values
+                if created:
+                    _check_round_trip(archive.variables['dis06'], written, values, file_path)
+                logger.info(f"Appended {times.size - first} time steps from {file_path}")
+
+def append_reforecast(file_paths, archive_path, tile=DEFAULT_TILE, init_chunk=REFORECAST_INIT_CHUNK):
+    """
+    Append monthly reforecast files, in chronological order, as new initialisations of dis24.
+    Initialisations at or before the last one already in the archive are skipped.
+    """
+    with nc.Dataset(archive_path, 'a' if os.path.exists(archive_path) else 'w', format='NETCDF4') as archive:
+        archive.set_auto_maskandscale(False)
+        for file_path in file_paths:
+            with nc.Dataset(file_path) as src:
+                src.set_auto_maskandscale(False)
+                src_var = src.variables['dis24']
+                src_valid_time = src.variables['valid_time']
+
+                created = 'dis24' not in archive.variables
+                if created:
+                    member_dim, step_dim = src_var.dimensions[:2]
+                    spatial_dims = src_var.dimensions[2:]
+                    _copy_coordinates(src, archive, spatial_dims)
+                    archive.createDimension('init', None)
+                    archive.createDimension(member_dim, len(src.dimensions[member_dim]))
+                    archive.createDimension(step_dim, len(src.dimensions[step_dim]))
+                    for name in ('number', 'step'):
+                        var = src.variables[name]
+                        out_var = _create_raw(archive, name, var.datatype, var.dimensions)
+                        _copy_attributes(var, out_var)
+                        out_var[:] = var[:]
+                    init_var = _create_raw(archive, 'init', 'f8', ('init',))
+                    valid_time_var = _create_raw(archive, 'valid_time', 'f8', ('init', step_dim))
+                    for var in (init_var, valid_time_var):
+                        var.units = src_valid_time.units
+                        var.calendar = getattr(src_valid_time, 'calendar', 'proleptic_gregorian')
+                    chunks = [init_chunk, len(src.dimensions[member_dim]), len(src.dimensions[step_dim])]
+                    out_var = _create_raw(archive, 'dis24', src_var.datatype, ('init',) + src_var.dimensions, zlib=True,
+                                          chunksizes=chunks + _spatial_chunks(archive, spatial_dims, tile),
+                                          fill_value=_fill_value(src_var))
+                    _copy_attributes(src_var, out_var)
+                _check_grid(archive, src, file_path)
+
+                # The first valid time identifies the initialisation, in archive units
+                valid_time_var = archive.variables['valid_time']
+                dates = nc.num2date(src_valid_time[:], units=src_valid_time.units,
+                                    calendar=getattr(src_valid_time, 'calendar', 'proleptic_gregorian'))
+                valid_times = np.asarray(nc.date2num(dates, units=valid_time_var.units, calendar=valid_time_var.calendar), dtype=float)
+                init_var = archive.variables['init']
+                position = len(init_var)
+                if position and valid_times[0] <= init_var[position - 1]:
+                    logger.info(f"Already in the archive, skipping {file_path}")
+                    continue
+
+                init_var[position] = valid_times[0]
+                valid_time_var[position] = valid_times
+                values = src_var[:]
+                archive.variables['dis24'][position] = values
+                if created:
+                    _check_round_trip(archive.variables['dis24'], position, values, file_path)
+                logger.info(f"Appended initialisation from {file_path}")
+
+def read_point_series(archive_path, variable, stations, station_index, time_name='time'):
+    """
+    Series at the grid cells of the stations, with the station as last axis, plus the time values,
+    their units and calendar and the station index entries.
+    With the time-chunked layout this touches only the chunks of the stations' spatial tiles.
+    """
+    with nc.Dataset(archive_path) as archive:
+        located = station_index.locate(archive, stations)
+        var = archive.variables[variable]
+        var.set_var_chunk_cache(size=CHUNK_CACHE_SIZE)
+
+        # Read the sorted unique rows and columns in one call and pick the station cells afterwards
+        unique_lat, lat_pos = np.unique([entry['lat_idx'] for entry in located], return_inverse=True)
+        unique_lon, lon_pos = np.unique([entry['lon_idx'] for entry in located], return_inverse=True)
+        values = var[..., unique_lat, unique_lon][..., lat_pos, lon_pos]
+
+        time_var = archive.variables[time_name]
+        return values, time_var[:], time_var.units, time_var.calendar, located
+
+#%% Consolidate the monthly archives, rerun after new months arrive to append them
+# from glob import glob
+# append_historical(sorted(glob(r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\*_EFAS_historical.nc")),
+#                   r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\EFAS_historical_archive.nc")
+# append_reforecast(sorted(glob(r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\*_EFAS_seasonal_reforecast.nc")),
+#                   r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\EFAS_seasonal_reforecast_archive.nc")
@@ -0,0 +1,144 @@
+#%% On-disk ensemble cube: every forecast of a .fcst or of an extraction run as one slice of a
+# memory-mapped (init, lead, member) float32 array, with an index from init date to slice.
+# Fetching a forecast is then a dictionary lookup and a slice instead of a scan of the table
+
+import json
+import os
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from fcst_reader import load_fcst_columns
+
+CUBE_SUFFIX = '.cube'
+
+def _seconds(date):
+    # Index key of a date given as string, datetime, Timestamp or datetime64
+    return int(np.datetime64(date, 's').astype(np.int64))
+
+class EnsembleCube:
+    """
+    Forecasts stored in a directory as .npy arrays: values (init, lead, member), inits, leads and
+    the number of leads of each forecast, shorter forecasts are padded with NaN.
+    The init of a forecast is the date on its first row, the date the plots look forecasts up by.
+    """
+    def __init__(self, directory, mode='r'):
+        self.directory = str(directory)
+        arrays = {name: np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode=mode)
+                  for name in ('values', 'inits', 'leads', 'lengths')}
+        self.values = arrays['values']
+        self.inits = arrays['inits']
+        self.leads = arrays['leads']
+        self.lengths = arrays['lengths']
+        # Slots that were never written (length 0) are left out of the index
+        self._positions = {int(key): position for position, (key, length)
+                           in enumerate(zip(np.asarray(self.inits).astype(np.int64), self.lengths)) if length > 0}
+
+    @classmethod
+    def create(cls, directory, n_inits, leads, n_members):
+        """
+        Create an empty cube on disk and open it for writing.
+        """
+        os.makedirs(directory, exist_ok=True)
+        values = open_memmap(os.path.join(directory, 'values.npy'), mode='w+', dtype=np.float32, shape=(n_inits, len(leads), n_members))
+        values[:] = np.nan
+        values.flush()
+        np.save(os.path.join(directory, 'inits.npy'), np.zeros(n_inits, dtype='datetime64[s]'))
+        np.save(os.path.join(directory, 'leads.npy'), np.asarray(leads, dtype=np.int32))
+        np.save(os.path.join(directory, 'lengths.npy'), np.zeros(n_inits, dtype=np.int32))
+        return cls(directory, mode='r+')
+
+    def __contains__(self, init):
+        return _seconds(init) in self._positions
+
+    def __len__(self):
+        return len(self.inits)
+
+    def index(self, init):
+        """
+        Position of the forecast with this init date, KeyError if there is none.
+        """
+        try:
+            return self._positions[_seconds(init)]
+        except KeyError:
+            raise KeyError(f"No forecast with init date {init}") from None
+
+    def forecast(self, init):
+        """
+        Leads and values (lead, member) of one forecast, without the padding.
+        """
+        position = self.index(init)
+        length = int(self.lengths[position])
+        return self.leads[:length], self.values[position, :length]
+
+    def trace(self, init, start_lead=None, n_leads=None):
+        """
+        Leads and values of one forecast from start_lead on, at most n_leads of them.
+        """
+        leads, values = self.forecast(init)
+        start = 0 if start_lead is None else int(np.searchsorted(leads, start_lead))
+        if start_lead is not None and (start == len(leads) or leads[start] != start_lead):
+            raise KeyError(f"No lead time {start_lead} in the forecast of {init}")
+        stop = len(leads) if n_leads is None else min(start + n_leads, len(leads))
+        return leads[start:stop], values[start:stop]
+
+    def write(self, position, init, values):
+        """
+        Store one forecast, values is (lead, member) and may be shorter than the cube's lead axis.
+        """
+        self.values[position, :len(values)] = values
+        self.inits[position] = np.datetime64(init, 's')
+        self.lengths[position] = len(values)
+        self._positions[_seconds(init)] = position
+
+    def flush(self):
+        """
+        Write the memory-mapped arrays to disk.
+        """
+        for array in (self.values, self.inits, self.leads, self.lengths):
+            array.flush()
+
+def cube_from_fcst(fcst_path, directory=None, date_format='%Y%m%d%H', n_members=None, cache=True):
+    """
+    Convert a .fcst to a cube, a forecast starts wherever the lead time does not increase.
+    """
+    directory = directory or f"{fcst_path}{CUBE_SUFFIX}"
+    dates, leads, members = load_fcst_columns(fcst_path, date_format, n_members, cache)
+    starts = np.flatnonzero(np.r_[True, leads[1:] <= leads[:-1]]) if len(leads) else np.empty(0, dtype=int)
+    lengths = np.diff(np.r_[starts, len(leads)])
+    longest = starts[np.argmax(lengths)] if len(starts) else 0
+
+    cube = EnsembleCube.create(directory, len(starts), leads[longest:longest + (lengths.max() if len(lengths) else 0)], len(members))
+    # Every row goes to (its forecast, its position in the forecast) in one assignment
+    forecast_ids = np.repeat(np.arange(len(starts)), lengths)
+    positions = np.arange(len(leads)) - np.repeat(starts, lengths)
+    cube.values[forecast_ids, positions] = members.T
+    cube.inits[:] = dates[starts]
+    cube.lengths[:] = lengths
+    cube.flush()
+    return EnsembleCube(directory)
+
+def load_cube(fcst_path, date_format='%Y%m%d%H', n_members=None, cache=None):
+    """
+    Cube of a .fcst kept next to it, rebuilt when the .fcst changed size or modification time.
+    With a ProcessedCache the cube, and the parsed .fcst it is built from, live in that cache.
+    """
+    if cache is not None:
+        params = {'date_format': date_format, 'n_members': n_members}
+        directory = cache.get(fcst_path, 'cube', params, lambda directory: cube_from_fcst(fcst_path, directory, date_format, n_members, cache))
+        return EnsembleCube(directory)
+
+    directory = f"{fcst_path}{CUBE_SUFFIX}"
+    meta_path = os.path.join(directory, 'meta.json')
+    stat = os.stat(fcst_path)
+    stamp = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'date_format': date_format, 'n_members': n_members}
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            if json.load(f) == stamp:
+                return EnsembleCube(directory)
+        os.remove(meta_path)
+
+    cube = cube_from_fcst(fcst_path, directory, date_format, n_members)
+    with open(meta_path, 'w') as f:
+        json.dump(stamp, f)
+    return cube
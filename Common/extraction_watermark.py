@@ -0,0 +1,92 @@
+#%% Watermarks for incremental point extraction. Each output file keeps a record of the
+# source files written to it, so a rerun appends only new months and rewinds the output
+# to the first month whose source file changed since the last run
+
+import functools
+import json
+import os
+
+from download_manifest import file_checksum
+
+WATERMARK_SUFFIX = '.watermark.json'
+
+@functools.lru_cache(maxsize=256)
+def _checksum(file_path, size, mtime_ns):
+    # Keyed by size and mtime, so the watermarks of several stations hash each file once
+    return file_checksum(file_path)
+
+class Watermark:
+    """
+    Source files written to one output, in order, with their size, mtime and checksum, and the
+    output offset and writer state before each of them. Saved as JSON next to the output.
+    """
+    def __init__(self, output_filename, params=None):
+        self.watermark_path = f"{output_filename}{WATERMARK_SUFFIX}"
+        self.output_filename = str(output_filename)
+        self.params = params or {}
+        self.files = []
+        self.end = None
+        if os.path.exists(self.watermark_path) and os.path.exists(self.output_filename):
+            with open(self.watermark_path, 'r') as f:
+                saved = json.load(f)
+            # Output written with other parameters cannot be extended, start over
+            if saved.get('params') == json.loads(json.dumps(self.params)):
+                self.files = saved['files']
+                self.end = saved['end']
+
+    def resume_point(self, file_paths):
+        """
+        Index of the first of file_paths that is new or changed, with the output offset and
+        writer state to restart from there. The offset is None when the output starts empty.
+        """
+        for index, file_path in enumerate(file_paths):
+            if index == len(self.files):
+                return (index,) + self._end()
+            if not self._unchanged(self.files[index], file_path):
+                entry = self.files[index]
+                del self.files[index:]
+                return index, entry['offset'], entry['state']
+        if len(self.files) > len(file_paths):
+            # Months dropped from the end, rewind past them
+            entry = self.files[len(file_paths)]
+            del self.files[len(file_paths):]
+            return len(file_paths), entry['offset'], entry['state']
+        return (len(file_paths),) + self._end()
+
+    def record(self, file_path, offset_before, state_before, offset_after, state_after):
+        """
+        Record a source file as written and save the watermark.
+        """
+        stat = os.stat(file_path)
+        self.files.append({
+            'file': os.path.basename(file_path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'checksum': _checksum(file_path, stat.st_size, stat.st_mtime_ns),
+            'offset': offset_before,
+            'state': state_before,
+        })
+        self.end = {'offset': offset_after, 'state': state_after}
+        self._save()
+
+    def _end(self):
+        end = self.end or {}
+        return end.get('offset'), end.get('state')
+
+    def _unchanged(self, entry, file_path):
+        if entry['file'] != os.path.basename(file_path) or not os.path.exists(file_path):
+            return False
+        stat = os.stat(file_path)
+        if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+            return True
+        # Only hash when size or mtime moved, a touched but identical file is kept
+        if stat.st_size != entry['size'] or _checksum(file_path, stat.st_size, stat.st_mtime_ns) != entry['checksum']:
+            return False
+        entry['mtime_ns'] = stat.st_mtime_ns
+        return True
+
+    def _save(self):
+        tmp_path = f"{self.watermark_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'params': self.params, 'files': self.files, 'end': self.end}, f, indent=1)
+        os.replace(tmp_path, self.watermark_path)
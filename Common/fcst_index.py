@@ -0,0 +1,104 @@
+#%% Byte-offset index of the forecasts in a .fcst: one scan records where each forecast block
+# starts in the file and its init date, reads of a date range then seek to the first block and
+# parse only the bytes up to the end of the last one instead of the whole text
+
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from fcst_reader import parse_fcst, fcst_frame
+
+INDEX_SUFFIX = '.idx.npz'
+INDEX_VERSION = 1
+
+def index_path(fcst_path):
+    return f"{fcst_path}{INDEX_SUFFIX}"
+
+def _source_stamp(fcst_path, date_format):
+    stat = os.stat(fcst_path)
+    return {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'date_format': date_format}
+
+def scan_blocks(fcst_path):
+    """
+    Byte offset, first-row date and row count of every forecast block of a .fcst, a block starts
+    wherever the lead time does not increase. Only the first two fields of each line are split.
+    """
+    offsets, inits, rows = [], [], []
+    offset = 0
+    previous_lead = None
+    with open(fcst_path, 'rb') as f:
+        for line in f:
+            fields = line.split(None, 2)
+            if len(fields) >= 2:
+                lead = float(fields[1])
+                if previous_lead is None or lead <= previous_lead:
+                    offsets.append(offset)
+                    inits.append(fields[0].decode())
+                    rows.append(0)
+                rows[-1] += 1
+                previous_lead = lead
+            offset += len(line)
+    return np.asarray(offsets, dtype=np.int64), inits, np.asarray(rows, dtype=np.int64), offset
+
+def build_index(fcst_path, date_format='%Y%m%d%H'):
+    """
+    Scan a .fcst and store its block index next to it, stamped with the size and modification time of the file.
+    """
+    offsets, inits, rows, size = scan_blocks(fcst_path)
+    inits = pd.to_datetime(pd.Series(inits, dtype=str), format=date_format).to_numpy(dtype='datetime64[s]')
+    stamp = _source_stamp(fcst_path, date_format)
+    tmp_path = f"{index_path(fcst_path)}.tmp.npz"
+    np.savez(tmp_path, offsets=np.r_[offsets, size], inits=inits, rows=rows, stamp=np.array(json.dumps(stamp)))
+    os.replace(tmp_path, index_path(fcst_path))
+    return offsets, inits, rows, size
+
+def load_index(fcst_path, date_format='%Y%m%d%H'):
+    """
+    Block offsets, init dates (datetime64[s]) and row counts of a .fcst plus the end offset of its last block,
+    rebuilt whenever the .fcst changed since the index was written.
+    """
+    try:
+        with np.load(index_path(fcst_path)) as stored:
+            if json.loads(str(stored['stamp'])) == _source_stamp(fcst_path, date_format):
+                return stored['offsets'][:-1], stored['inits'], stored['rows'], int(stored['offsets'][-1])
+    except (OSError, ValueError, KeyError):
+        pass
+    return build_index(fcst_path, date_format)
+
+def read_block_range(fcst_path, start=None, end=None, date_format='%Y%m%d%H', n_members=None):
+    """
+    Columns as in parse_fcst of the forecasts whose init date lies in [start, end], either bound may be None.
+    Blocks are read in file order, contiguous runs of selected blocks with one seek and one read each.
+    """
+    offsets, inits, rows, size = load_index(fcst_path, date_format)
+    selected = np.ones(len(inits), dtype=bool)
+    if start is not None:
+        selected &= inits >= np.datetime64(pd.Timestamp(start), 's')
+    if end is not None:
+        selected &= inits <= np.datetime64(pd.Timestamp(end), 's')
+    ends = np.r_[offsets[1:], size]
+    # Runs of consecutive selected blocks become one contiguous byte range
+    run_starts = np.flatnonzero(selected & ~np.r_[False, selected[:-1]])
+    run_stops = np.flatnonzero(selected & ~np.r_[selected[1:], False])
+    parts = []
+    with open(fcst_path, 'rb') as f:
+        for first, last in zip(run_starts, run_stops):
+            f.seek(offsets[first])
+            data = f.read(ends[last] - offsets[first])
+            if n_members is None:
+                n_members = len(data.split(b'\n', 1)[0].split()) - 2
+            parts.append(parse_fcst(io.BytesIO(data), date_format, n_members))
+    if not parts:
+        return (np.empty(0, dtype='datetime64[s]'), np.empty(0, dtype=np.int32),
+                np.empty((n_members or 0, 0), dtype=np.float32))
+    return (np.concatenate([part[0] for part in parts]), np.concatenate([part[1] for part in parts]),
+            np.concatenate([part[2] for part in parts], axis=1))
+
+def read_fcst_inits(fcst_path, start=None, end=None, names=None, date_format='%Y%m%d%H', n_members=None):
+    """
+    DataFrame as in read_fcst holding only the forecasts initialised between start and end, e.g. one season.
+    """
+    return fcst_frame(*read_block_range(fcst_path, start, end, date_format, n_members), names)
@@ -0,0 +1,108 @@
+#%% Shared reader for the EVS .fcst layout (date, lead time, ensemble members). The text is
+# parsed once and stored next to it as binary columns, later loads memory-map those columns
+# and fall back to parsing whenever the .fcst changed size or modification time
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from processed_cache import ProcessedCache
+
+SIDECAR_SUFFIX = '.cols'
+SIDECAR_VERSION = 1
+
+def sidecar_path(fcst_path):
+    return f"{fcst_path}{SIDECAR_SUFFIX}"
+
+def _source_stamp(fcst_path, date_format, n_members):
+    stat = os.stat(fcst_path)
+    return {'version': SIDECAR_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'date_format': date_format, 'n_members': n_members}
+
+def parse_fcst(fcst_path, date_format='%Y%m%d%H', n_members=None):
+    """
+    Parse a whitespace separated .fcst, given as a path or a buffer, into (dates datetime64[s], leads int32,
+    members float32 of shape (member, row)). Without n_members every column after the lead time is a member.
+    """
+    if n_members is None:
+        with open(fcst_path, 'r') as f:
+            n_members = len(f.readline().split()) - 2
+    table = pd.read_csv(fcst_path, sep=r'\s+', header=None, usecols=range(n_members + 2), dtype={0: str}, engine='c')
+    dates = pd.to_datetime(table[0], format=date_format).to_numpy(dtype='datetime64[s]')
+    leads = table[1].to_numpy(dtype=np.int32)
+    members = np.ascontiguousarray(table.iloc[:, 2:].to_numpy(dtype=np.float32).T)
+    return dates, leads, members
+
+def load_fcst_columns(fcst_path, date_format='%Y%m%d%H', n_members=None, cache=True, start=None, end=None):
+    """
+    Columns of a .fcst as in parse_fcst, memory-mapped from the sidecar when it is up to date.
+    The sidecar is (re)written after parsing, unless cache is False. With a ProcessedCache the
+    columns are kept in that shared cache instead of next to the .fcst.
+    start and end restrict the rows to dates in [start, end].
+    """
+    if isinstance(cache, ProcessedCache):
+        params = {'date_format': date_format, 'n_members': n_members}
+        path = cache.lookup(fcst_path, 'fcst', params)
+        if path is None:
+            dates, leads, members = parse_fcst(fcst_path, date_format, n_members)
+            # Rows first, so a date range is a slice of every column
+            path = cache.store_columns(fcst_path, 'fcst', params, {'dates': dates, 'leads': leads, 'members': members.T}, index_column='dates')
+        columns = cache.load_columns(path, start=start, end=end)
+        return columns['dates'], columns['leads'], columns['members'].T
+
+    columns = _load_sidecar(fcst_path, date_format, n_members, cache)
+    if start is None and end is None:
+        return columns
+    dates, leads, members = columns
+    rows = np.ones(len(dates), dtype=bool)
+    if start is not None:
+        rows &= dates >= np.datetime64(start, 's')
+    if end is not None:
+        rows &= dates <= np.datetime64(end, 's')
+    return dates[rows], leads[rows], members[:, rows]
+
+def _load_sidecar(fcst_path, date_format, n_members, cache):
+    directory = sidecar_path(fcst_path)
+    meta_path = os.path.join(directory, 'meta.json')
+    stamp = _source_stamp(fcst_path, date_format, n_members)
+
+    if cache and os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta == stamp:
+            return tuple(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in ('dates', 'leads', 'members'))
+
+    columns = parse_fcst(fcst_path, date_format, n_members)
+    if cache:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # The stamp goes last, a sidecar cut off while writing is never trusted
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+            for name, values in zip(('dates', 'leads', 'members'), columns):
+                np.save(os.path.join(directory, f"{name}.npy"), values)
+            with open(f"{meta_path}.tmp", 'w') as f:
+                json.dump(stamp, f)
+            os.replace(f"{meta_path}.tmp", meta_path)
+        except OSError as e:
+            print(f"Could not write the .fcst sidecar {directory}: {e}")
+    return columns
+
+def read_fcst(fcst_path, names=None, date_format='%Y%m%d%H', n_members=None, cache=True, start=None, end=None, dtype=np.float64):
+    """
+    Read a .fcst into a DataFrame with a datetime date column, an int lead time column and members of dtype.
+    names defaults to date, lead_time, ensemble_1 ... ensemble_n. Members default to float64 so scripts can
+    write corrected values back into them, float32 keeps the frame at the size of the sidecar.
+    """
+    return fcst_frame(*load_fcst_columns(fcst_path, date_format, n_members, cache, start, end), names, dtype)
+
+def fcst_frame(dates, leads, members, names=None, dtype=np.float64):
+    """
+    DataFrame of .fcst columns, names defaults to date, lead_time, ensemble_1 ... ensemble_n.
+    """
+    names = names or ['date', 'lead_time'] + [f'ensemble_{i}' for i in range(1, len(members) + 1)]
+    columns = {names[0]: dates, names[1]: leads}
+    columns.update(zip(names[2:], members.astype(dtype, copy=False)))
+    return pd.DataFrame(columns)
@@ -0,0 +1,97 @@
+#%% High-throughput writer for the EVS .fcst layout (date, lead time, ensemble members).
+# Whole blocks of rows are formatted with one precompiled template instead of one
+# format call per value, and written with a single write per block
+
+import re
+import time
+
+import numpy as np
+
+from fcst_reader import read_fcst
+
+CHUNK_ROWS = 20000  # Rows formatted per template call, bounds the size of the temporary string
+
+def _check_dates(dates):
+    dates = np.asarray(dates)
+    if dates.dtype.kind in 'US' or (dates.dtype.kind == 'O' and all(isinstance(date, str) for date in dates)):
+        return
+    raise TypeError(f"Dates of .fcst rows must be formatted strings, got {dates.dtype} values")
+
+def format_fcst_rows(dates, leadtimes, members, member_format='%.1f', sep=' ', missing=None):
+    """
+    Format rows of (date string, lead time, members...) into .fcst text.
+    members is a 2-D array of shape (rows, ensemble members), NaN members are written as missing when it is given.
+    Dates must already be formatted strings, e.g. from time_axis.format_dates: datetime64 values would be written
+    with an embedded space and add a column to every row.
+    """
+    members = np.ma.filled(np.ma.asarray(members), np.nan) if np.ma.isMaskedArray(members) else np.asarray(members)
+    n_rows, n_members = members.shape
+    if n_rows == 0:
+        return ''
+    _check_dates(dates)
+
+    row_template = sep.join(['%s', '%d'] + [member_format] * n_members) + '\n'
+    columns = np.empty((n_rows, n_members + 2), dtype=object)
+    columns[:, 0] = dates
+    columns[:, 1] = leadtimes
+    columns[:, 2:] = members
+    # One C-level % call for the whole block
+    text = (row_template * n_rows) % tuple(columns.ravel().tolist())
+    if missing is not None and members.dtype.kind == 'f' and np.isnan(members).any():
+        # Only whole member fields read nan, dates and lead times never do
+        text = re.sub(f"(?<={re.escape(sep)})nan(?={re.escape(sep)}|\n)", missing, text)
+    return text
+
+def write_fcst_rows(fcst_file, dates, leadtimes, members, member_format='%.1f', sep=' ', missing=None):
+    """
+    Append rows to an open .fcst file, formatting CHUNK_ROWS rows at a time.
+    """
+    for start in range(0, len(dates), CHUNK_ROWS):
+        stop = start + CHUNK_ROWS
+        fcst_file.write(format_fcst_rows(dates[start:stop], leadtimes[start:stop], members[start:stop], member_format, sep, missing))
+
+def write_fcst_file(fcst_filename, dates, leadtimes, members, member_format='%.1f', sep=' ', missing=None):
+    """
+    Write a complete .fcst file, without header.
+    """
+    with open(fcst_filename, 'w') as fcst_file:
+        write_fcst_rows(fcst_file, dates, leadtimes, members, member_format, sep, missing)
+
+def check_fcst_file(fcst_filename, dates, leadtimes, members, decimals=1, date_format='%Y%m%d%H'):
+    """
+    Read a written .fcst back with read_fcst and raise a ValueError unless it holds the given rows:
+    the same dates (datetime64) and lead times, and members equal up to the written decimals.
+    """
+    members = np.asarray(members, dtype=np.float64)
+    written = read_fcst(fcst_filename, date_format=date_format, n_members=members.shape[1], cache=False)
+    if (len(written) != len(members)
+            or not np.array_equal(written.iloc[:, 0].to_numpy(dtype='datetime64[s]'), np.asarray(dates, dtype='datetime64[s]'))
+            or not np.array_equal(written.iloc[:, 1].to_numpy(), np.asarray(leadtimes))
+            or not np.allclose(written.iloc[:, 2:].to_numpy(), members, rtol=1e-6, atol=0.51 * 10.0 ** -decimals, equal_nan=True)):
+        raise ValueError(f"{fcst_filename} does not read back as the rows written to it")
+
+def benchmark_writer(n_rows=200000, n_members=25):
+    """
+    Compare the per-value f-string join used before with the bulk template on random data.
+    """
+    rng = np.random.default_rng(0)
+    members = (rng.random((n_rows, n_members)) * 500).astype(np.float32)
+    leadtimes = np.tile(np.arange(24, 24 * 216, 24), n_rows // 215 + 1)[:n_rows]
+    dates = ['2000010100'] * n_rows
+
+    start_time = time.perf_counter()
+    legacy = ''.join(f"{dates[row]} {int(leadtimes[row])} " + ' '.join(f'{members[row, member]:.1f}' for member in range(n_members)) + '\n'
+                     for row in range(n_rows))
+    legacy_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    bulk = ''.join(format_fcst_rows(dates[start:start + CHUNK_ROWS], leadtimes[start:start + CHUNK_ROWS], members[start:start + CHUNK_ROWS])
+                   for start in range(0, n_rows, CHUNK_ROWS))
+    bulk_time = time.perf_counter() - start_time
+
+    assert legacy == bulk, "Bulk writer output differs from the per-value writer"
+    print(f"Per-value f-strings: {n_rows / legacy_time:,.0f} rows/s")
+    print(f"Bulk template:       {n_rows / bulk_time:,.0f} rows/s ({legacy_time / bulk_time:.1f}x faster)")
+
+#%% Benchmark against the per-value writer
+# benchmark_writer()
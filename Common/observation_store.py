@@ -0,0 +1,209 @@
+#%% Consolidated observation store: the .obs series of many stations parsed once into one
+# memory-mapped array of (date, value) records, with a JSON index from station to its slice.
+# Scripts fetch a station's series by date range and resample it without parsing any text
+
+import contextlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+RECORD_DTYPE = np.dtype([('date', 'datetime64[s]'), ('value', np.float64)])
+PERIODS = {'M': 'datetime64[M]', 'Y': 'datetime64[Y]'}
+REDUCTIONS = ('sum', 'mean', 'min', 'max', 'count')
+LOCK_POLL = 0.1  # Seconds between attempts to take the writer lock
+LOCK_STALE = 600  # Seconds after which a lock file is taken to be left behind by a writer that died
+
+def _source_stamp(obs_path, date_format):
+    stat = os.stat(obs_path)
+    return {'path': os.path.abspath(obs_path), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'date_format': date_format}
+
+def parse_obs(obs_path, date_format='%Y%m%d'):
+    """
+    Dates (datetime64[s]) and values of a whitespace separated date/value text file, sorted by date.
+    """
+    table = pd.read_csv(obs_path, sep=r'\s+', header=None, usecols=[0, 1], dtype={0: str}, engine='c')
+    dates = pd.to_datetime(table[0], format=date_format).to_numpy(dtype='datetime64[s]')
+    values = table[1].to_numpy(dtype=np.float64)
+    order = np.argsort(dates, kind='stable')
+    return dates[order], values[order]
+
+def resample_series(series, freq='M', how='sum'):
+    """
+    Vectorized monthly ('M') or annual ('Y') sum, mean, min, max or count of a date indexed series, NaN skipped.
+    Periods are labelled by their first day and only periods holding values are returned, as a groupby would.
+    """
+    if freq not in PERIODS or how not in REDUCTIONS:
+        raise ValueError(f"Unsupported resampling {freq}/{how}, use one of {list(PERIODS)} and {REDUCTIONS}")
+    keys = series.index.to_numpy(dtype='datetime64[s]').astype(PERIODS[freq])
+    values = series.to_numpy(dtype=np.float64)
+    order = np.argsort(keys, kind='stable')
+    keys, values = keys[order], values[order]
+    valid = ~np.isnan(values)
+    keys, values = keys[valid], values[valid]
+    if not len(keys):
+        return pd.Series(np.empty(0), index=pd.DatetimeIndex(np.empty(0, dtype='datetime64[s]')), name=series.name)
+    # Periods are contiguous runs of the sorted keys, each reduced in one ufunc call
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    counts = np.diff(np.r_[starts, len(keys)])
+    if how == 'count':
+        result = counts.astype(np.float64)
+    elif how in ('sum', 'mean'):
+        result = np.add.reduceat(values, starts)
+        if how == 'mean':
+            result = result / counts
+    else:
+        result = (np.minimum if how == 'min' else np.maximum).reduceat(values, starts)
+    return pd.Series(result, index=pd.DatetimeIndex(keys[starts].astype('datetime64[s]')), name=series.name)
+
+class ObservationStore:
+    """
+    Observation series of many stations in one directory: a .npy of (date, value) records in which every
+    station is a contiguous slice sorted by date, and index.json with the slice and source file of each station.
+    """
+    def __init__(self, directory):
+        self.directory = str(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        while True:
+            try:
+                with open(os.path.join(self.directory, 'index.json'), 'r') as f:
+                    index = json.load(f)
+            except (OSError, ValueError):
+                index = None
+            if index is None or index.get('version') != STORE_VERSION:
+                index = {'version': STORE_VERSION, 'generation': 0, 'series': None, 'stations': {}}
+            if index['series'] is None:
+                records = np.empty(0, dtype=RECORD_DTYPE)
+                break
+            try:
+                records = np.load(os.path.join(self.directory, index['series']), mmap_mode='r')
+                break
+            except FileNotFoundError:
+                continue  # Another process swapped in a newer generation and removed this one, read its index
+        self.index = index
+        self.records = records
+        self._sweep()
+
+    def _sweep(self):
+        # Older generations left behind while another process still had them mapped. Newer ones are
+        # never touched, a writer holding the lock may be writing the next generation right now
+        for name in os.listdir(self.directory):
+            if name.startswith('series_') and name.endswith('.npy'):
+                try:
+                    if int(name[len('series_'):-len('.npy')]) < self.index['generation']:
+                        os.remove(os.path.join(self.directory, name))
+                except (ValueError, OSError):
+                    pass  # Still mapped elsewhere, a later open removes it
+
+    @contextlib.contextmanager
+    def _locked(self):
+        # One writer at a time across processes: the lock file is created exclusively and removed when done
+        lock_path = os.path.join(self.directory, 'index.lock')
+        while True:
+            try:
+                os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                break
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > LOCK_STALE:
+                        os.remove(lock_path)
+                        continue
+                except OSError:
+                    continue  # Released in the meantime
+                time.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            os.remove(lock_path)
+
+    def __contains__(self, station):
+        return station in self.index['stations']
+
+    def stations(self):
+        return list(self.index['stations'])
+
+    def add(self, station, obs_path, date_format='%Y%m%d'):
+        """
+        Parse a date/value text file into the store under station, skipped when the stored series comes from
+        the same version of the file. Returns the store, so a read can follow directly.
+        Safe while other processes read or add to the same store, writers take turns through a lock file.
+        """
+        stamp = _source_stamp(obs_path, date_format)
+        entry = self.index['stations'].get(station)
+        if entry is not None and entry['source'] == stamp:
+            return self
+        dates, values = parse_obs(obs_path, date_format)
+        records = np.empty(len(dates), dtype=RECORD_DTYPE)
+        records['date'] = dates
+        records['value'] = values
+        with self._locked():
+            # The next generation builds on the latest index, not the one read when this store was opened,
+            # so stations added by other processes in the meantime are kept
+            self.records = None
+            self._open()
+            entry = self.index['stations'].get(station)
+            if entry is None or entry['source'] != stamp:
+                self._rewrite(station, records, stamp)
+        return self
+
+    def _rewrite(self, station, records, stamp):
+        # The series go to a new generation of the records file and the index is swapped in last,
+        # a reader never sees an index pointing at a partly written file
+        stations, parts, offset = {}, [], 0
+        for name, entry in self.index['stations'].items():
+            if name == station:
+                continue
+            parts.append(self.records[entry['start']:entry['stop']])
+            stations[name] = dict(entry, start=offset, stop=offset + entry['stop'] - entry['start'])
+            offset = stations[name]['stop']
+        parts.append(records)
+        stations[station] = {'start': offset, 'stop': offset + len(records), 'source': stamp}
+        generation = self.index['generation'] + 1
+        series = f"series_{generation}.npy"
+        np.save(os.path.join(self.directory, series), np.concatenate(parts))
+        # Drop every view of the old memmap, so it is unmapped before its file is removed
+        # (Windows refuses to delete a mapped file); reads hand out copies, never views
+        del parts
+        self.records = None
+        index = {'version': STORE_VERSION, 'generation': generation, 'series': series, 'stations': stations}
+        tmp_path = os.path.join(self.directory, 'index.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, indent=1)
+        os.replace(tmp_path, os.path.join(self.directory, 'index.json'))
+        self._open()
+
+    def _slice(self, station, start=None, end=None):
+        entry = self.index['stations'].get(station)
+        if entry is None:
+            raise KeyError(f"No station {station} in the observation store {self.directory}")
+        records = self.records[entry['start']:entry['stop']]
+        first = 0 if start is None else np.searchsorted(records['date'], np.datetime64(pd.Timestamp(start), 's'), side='left')
+        last = len(records) if end is None else np.searchsorted(records['date'], np.datetime64(pd.Timestamp(end), 's'), side='right')
+        return np.array(records[first:last])
+
+    def get(self, station, start=None, end=None):
+        """
+        Series of one station indexed by date, restricted to [start, end] when either bound is given.
+        """
+        records = self._slice(station, start, end)
+        return pd.Series(records['value'], index=pd.DatetimeIndex(records['date'], name='date'), name=station)
+
+    def frame(self, station, names=('date', 'value'), start=None, end=None):
+        """
+        Series of one station as a two column DataFrame, the layout the .obs files were read into.
+        """
+        records = self._slice(station, start, end)
+        return pd.DataFrame({names[0]: records['date'], names[1]: records['value']})
+
+    def resample(self, station, freq='M', how='sum', start=None, end=None):
+        """
+        Monthly or annual reduction of one station's series, see resample_series.
+        """
+        return resample_series(self.get(station, start, end), freq, how)
@@ -0,0 +1,170 @@
+#%% Versioned cache of processed data derived from source files (parsed .fcst columns, ensemble
+# cubes). Entries are keyed on the source path and validated against its size, mtime and content
+# hash, stored as one .npy per column so subsets can be memory-mapped, and the whole cache is kept
+# under a size bound by evicting the least recently used entries
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+
+import numpy as np
+
+from download_manifest import file_checksum
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+DEFAULT_MAX_BYTES = 5 * 1024 ** 3
+META_NAME = 'meta.json'
+
+def _directory_size(directory):
+    return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+class ProcessedCache:
+    """
+    Directory of cache entries shared by every station and forecast system, at most max_bytes in total.
+    Entries this instance has handed out are in use, they may be memory-mapped and are never evicted by it.
+    """
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = str(cache_dir)
+        self.max_bytes = max_bytes
+        self.in_use = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def entry_path(self, source_path, kind, params=None):
+        key = json.dumps([os.path.abspath(source_path), kind, params or {}], sort_keys=True)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{os.path.basename(source_path)}.{kind}.{digest}")
+
+    def lookup(self, source_path, kind, params=None):
+        """
+        Path of the entry if it is still valid for the source, else None. A changed mtime with the
+        same size and content hash keeps the entry.
+        """
+        path = self.entry_path(source_path, kind, params)
+        meta = self._read_meta(path)
+        if meta is None or meta['version'] != CACHE_VERSION or meta['source'] != os.path.abspath(source_path):
+            return None
+        stat = os.stat(source_path)
+        if stat.st_size != meta['size']:
+            return None
+        if stat.st_mtime_ns != meta['mtime_ns']:
+            if file_checksum(source_path) != meta['sha256']:
+                return None
+            meta['mtime_ns'] = stat.st_mtime_ns
+        meta['last_used'] = time.time()
+        self._write_meta(path, meta)
+        self.in_use.add(path)
+        return path
+
+    def build(self, source_path, kind, params, builder, **meta_fields):
+        """
+        Build an entry with builder(directory), which writes its files into directory, then evict
+        old entries if the cache grew past its bound. Entries in use, e.g. the parsed .fcst a cube was
+        built from, are left in place.
+        """
+        path = self.entry_path(source_path, kind, params)
+        # Stamp the source before building, a change while building then invalidates the entry
+        stat = os.stat(source_path)
+        meta = {'version': CACHE_VERSION, 'source': os.path.abspath(source_path), 'kind': kind, 'params': params or {},
+                'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_checksum(source_path)}
+        meta.update(meta_fields)
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        try:
+            builder(tmp_path)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+        meta['bytes'] = _directory_size(path)
+        meta['last_used'] = time.time()
+        self._write_meta(path, meta)
+        self.in_use.add(path)
+        self.evict()
+        return path
+
+    def get(self, source_path, kind, params, builder, **meta_fields):
+        """
+        Valid entry of the source, built first when it is missing or stale.
+        """
+        return self.lookup(source_path, kind, params) or self.build(source_path, kind, params, builder, **meta_fields)
+
+    def store_columns(self, source_path, kind, params, columns, index_column=None):
+        """
+        Store a dict of arrays as one .npy per column. Columns share their first axis (rows), and
+        index_column, e.g. the dates, is what load_columns selects row ranges on.
+        """
+        def builder(directory):
+            for name, values in columns.items():
+                np.save(os.path.join(directory, f"{name}.npy"), values)
+        return self.build(source_path, kind, params, builder, columns=list(columns), index_column=index_column)
+
+    def load_columns(self, path, names=None, start=None, end=None):
+        """
+        Memory-mapped columns of an entry, all of them or only names, restricted to the rows whose
+        index value lies in [start, end] when either bound is given.
+        """
+        meta = self._read_meta(path)
+        self.in_use.add(path)
+        names = names or meta['columns']
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r') for name in names}
+        if start is None and end is None:
+            return columns
+
+        index = np.load(os.path.join(path, f"{meta['index_column']}.npy"), mmap_mode='r')
+        start = index[0] if start is None else np.asarray(start, dtype=index.dtype)
+        end = index[-1] if end is None else np.asarray(end, dtype=index.dtype)
+        if np.all(index[1:] >= index[:-1]):
+            # Sorted index, the range is one contiguous slice and stays memory-mapped
+            rows = slice(np.searchsorted(index, start, 'left'), np.searchsorted(index, end, 'right'))
+        else:
+            rows = (index >= start) & (index <= end)
+        return {name: values[rows] for name, values in columns.items()}
+
+    def evict(self, keep=()):
+        """
+        Remove least recently used entries until the cache fits in max_bytes, skipping the entries
+        in use and those in keep. Returns the size of the cache afterwards, which stays above
+        max_bytes when only entries in use or entries that could not be removed are left.
+        """
+        keep = self.in_use.union(keep)
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            meta = self._read_meta(entry.path) if entry.is_dir() else None
+            if meta is not None:
+                entries.append((meta.get('last_used', 0), meta.get('bytes', 0), entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            try:
+                shutil.rmtree(path)
+                total -= size
+            except OSError as e:
+                # Memory-mapped by another process, Windows refuses to remove its files
+                logger.warning(f"Could not evict {path}: {e}")
+        if total > self.max_bytes:
+            logger.warning(f"Processed-data cache {self.cache_dir} holds {total / 1e6:.0f} MB, over its bound of {self.max_bytes / 1e6:.0f} MB")
+        return total
+
+    def _read_meta(self, path):
+        meta_path = os.path.join(path, META_NAME)
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def _write_meta(self, path, meta):
+        meta_path = os.path.join(path, META_NAME)
+        with open(f"{meta_path}.tmp", 'w') as f:
+            json.dump(meta, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
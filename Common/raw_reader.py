@@ -0,0 +1,161 @@
+#%% Mask-free point reads for the EFAS extractors. Values are read raw, with netCDF4's
+# auto-masking and auto-scaling off, into a preallocated float buffer, values netCDF4 would mask
+# are turned into NaN in place and the chunk cache is tuned to the point hyperslab
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import netCDF4 as nc
+import numpy as np
+
+def _indices(key, size):
+    # Indices selected along one dimension by an int, slice or index array
+    if isinstance(key, slice):
+        return np.arange(size)[key]
+    return np.atleast_1d(np.asarray(key))
+
+def tune_chunk_cache(var):
+    """
+    Turn the chunk cache of var off for a point hyperslab, which visits every chunk once.
+    Without a cache HDF5 reads only the selected values of uncompressed chunks instead of
+    whole chunks, and decompresses each compressed chunk once either way.
+    """
+    if var.chunking() != 'contiguous':
+        var.set_var_chunk_cache(size=0, nelems=1, preemption=1.0)
+
+def _invalid_bounds(var):
+    # What netCDF4's auto-masking masks, in the packed units of the stored values: _FillValue
+    # (the netCDF default fill without one), missing_value and valid_min/valid_max/valid_range
+    attrs = var.ncattrs()
+    kind = var.dtype.str[1:]
+    if '_FillValue' in attrs:
+        equal = [var.getncattr('_FillValue')]
+    else:
+        equal = [nc.default_fillvals[kind]] if kind in nc.default_fillvals else []
+    if 'missing_value' in attrs:
+        equal += list(np.ravel(var.getncattr('missing_value')))
+    valid_min, valid_max = np.ravel(var.getncattr('valid_range')) if 'valid_range' in attrs else (None, None)
+    valid_min = var.getncattr('valid_min') if 'valid_min' in attrs else valid_min
+    valid_max = var.getncattr('valid_max') if 'valid_max' in attrs else valid_max
+    # Cast through the variable type, as the stored values were
+    cast = lambda value: None if value is None else np.asarray(value).astype(var.dtype).item()
+    return [cast(value) for value in equal], cast(valid_min), cast(valid_max)
+
+def read_raw(var, key, out=None, dtype=np.float64, mask=None):
+    """
+    Read var[key] without masked arrays and return it as floats with NaN where netCDF4 would mask.
+    The result goes into out and the mask work into mask when given, buffers reused across files.
+    """
+    var.set_auto_maskandscale(False)
+    tune_chunk_cache(var)
+    # netCDF4 has no out= argument, the packed values of the hyperslab are the one array allocated per read
+    raw = var[key]
+    if out is None:
+        out = np.empty(raw.shape, dtype=dtype)
+    if mask is None:
+        mask = np.empty(raw.shape, dtype=bool)
+    out[...] = raw
+    del raw
+
+    # Invalid values become NaN in place before unpacking, NaN never compares equal to a later bound
+    equal, valid_min, valid_max = _invalid_bounds(var)
+    for value in equal:
+        np.copyto(out, np.nan, where=np.equal(out, value, out=mask))
+    if valid_min is not None:
+        np.copyto(out, np.nan, where=np.less(out, valid_min, out=mask))
+    if valid_max is not None:
+        np.copyto(out, np.nan, where=np.greater(out, valid_max, out=mask))
+    if 'scale_factor' in var.ncattrs():
+        out *= var.getncattr('scale_factor')
+    if 'add_offset' in var.ncattrs():
+        out += var.getncattr('add_offset')
+    return out
+
+class PointBuffer:
+    """
+    Preallocated float and mask buffers for reads of the same shape, e.g. (member, step) per monthly file.
+    A read overwrites the previous one, so consume each result before the next read.
+    """
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self.buffer = None
+        self.mask = None
+
+    def read(self, var, key):
+        # Shape of the hyperslab, integer indices drop their dimension
+        shape = tuple(_indices(dim_key, size).size for dim_key, size in zip(key, var.shape)
+                      if not isinstance(dim_key, (int, np.integer)))
+        shape += var.shape[len(key):]
+        if self.buffer is None or self.buffer.shape != shape:
+            self.buffer = np.empty(shape, dtype=self.dtype)
+            self.mask = np.empty(shape, dtype=bool)
+        return read_raw(var, key, self.buffer, mask=self.mask)
+
+def make_benchmark_files(directory, n_files=3, shape=(25, 215, 70, 150), chunks=(1, 215, 70, 150)):
+    """
+    Write reforecast-sized dis24 files (member, step, y, x) with a fill value and scattered gaps.
+    """
+    rng = np.random.default_rng(0)
+    file_paths = []
+    for index in range(n_files):
+        file_path = os.path.join(directory, f"benchmark_{index:02d}.nc")
+        with nc.Dataset(file_path, 'w') as ds:
+            for name, size in zip(('number', 'step', 'y', 'x'), shape):
+                ds.createDimension(name, size)
+            var = ds.createVariable('dis24', 'f4', ('number', 'step', 'y', 'x'), chunksizes=chunks, fill_value=-9999.0)
+            data = rng.gamma(2.0, 50.0, size=shape).astype(np.float32)
+            data[rng.random(shape) < 0.01] = -9999.0
+            var[:] = data
+        file_paths.append(file_path)
+    return file_paths
+
+def benchmark_reads(file_paths=None, point=(35, 75)):
+    """
+    Compare default masked reads, masked reads with the chunk cache off and raw buffered reads of one
+    point from every file. Reports MB/s over the chunks that hold the point and the bytes allocated per
+    read (tracemalloc peak), leaving out the first file, where the reused buffers are allocated.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        file_paths = file_paths or make_benchmark_files(directory)
+        buffer = PointBuffer()
+        key = (slice(None), slice(None)) + tuple(point)
+
+        def masked(ds):
+            return np.ma.filled(ds.variables['dis24'][key].astype(float), np.nan)
+
+        def masked_no_cache(ds):
+            tune_chunk_cache(ds.variables['dis24'])
+            return masked(ds)
+
+        def raw(ds):
+            return buffer.read(ds.variables['dis24'], key)
+
+        results = {}
+        for name, read in (('masked', masked), ('masked, no cache', masked_no_cache), ('raw', raw)):
+            touched = 0
+            elapsed = 0.0
+            peak = 0
+            for index, file_path in enumerate(file_paths):
+                with nc.Dataset(file_path) as ds:
+                    var = ds.variables['dis24']
+                    chunking = var.chunking()
+                    touched += var.dtype.itemsize * (var.size if chunking == 'contiguous' else int(np.prod(chunking))
+                                                     * int(np.prod([-(-size // chunk) for size, chunk in zip(var.shape[:2], chunking[:2])])))
+                    tracemalloc.start()
+                    start_time = time.perf_counter()
+                    values = read(ds)
+                    elapsed += time.perf_counter() - start_time
+                    if index or len(file_paths) == 1:
+                        peak = max(peak, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+            results[name] = values.copy()
+            print(f"{name:>16}: {elapsed / len(file_paths) * 1000:.1f} ms/file, {touched / elapsed / 1e6:.0f} MB/s of the chunks holding the point, "
+                  f"peak allocation {peak / 1024:.0f} KiB per read")
+
+        assert all(np.array_equal(results['masked'], values, equal_nan=True) for values in results.values())
+        return results
+
+#%% Benchmark on synthetic reforecast-sized files
+# benchmark_reads()
@@ -0,0 +1,50 @@
+#%% Station catalog shared by the downloaders and the point extractors, so that the
+# CDS 'area' requested and the points extracted afterwards always cover the same domain
+
+import csv
+import math
+import os
+
+DEFAULT_CATALOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stations.csv')
+EFAS_GRID_RESOLUTION = 0.05  # EFAS v4 grid spacing in degrees, about 5 km
+
+def load_station_catalog(catalog_path=DEFAULT_CATALOG):
+    """
+    Read the station catalog (station, basin, latitude, longitude) into a list of dictionaries.
+    """
+    with open(catalog_path, newline='', encoding='utf-8') as f:
+        stations = []
+        for row in csv.DictReader(f):
+            row['latitude'] = float(row['latitude'])
+            row['longitude'] = float(row['longitude'])
+            stations.append(row)
+    return stations
+
+def get_station(stations, station_name):
+    """
+    Look up one station of the catalog by name.
+    """
+    for station in stations:
+        if station['station'] == station_name:
+            return station
+    raise KeyError(f"Station {station_name} not found in the station catalog")
+
+def station_area(stations, grid_resolution=EFAS_GRID_RESOLUTION, halo=2):
+    """
+    Tightest grid-aligned CDS area [North, West, South, East] around all stations,
+    widened by halo grid cells on every side.
+    """
+    latitudes = [station['latitude'] for station in stations]
+    longitudes = [station['longitude'] for station in stations]
+
+    # Snap outwards to the grid, rounding first so that points already on a grid line stay there
+    def snap(value, rounding):
+        return rounding(round(value / grid_resolution, 6)) * grid_resolution
+
+    north = snap(max(latitudes), math.ceil) + halo * grid_resolution
+    west = snap(min(longitudes), math.floor) - halo * grid_resolution
+    south = snap(min(latitudes), math.floor) - halo * grid_resolution
+    east = snap(max(longitudes), math.ceil) + halo * grid_resolution
+
+    decimals = max(0, -math.floor(math.log10(grid_resolution)) + 1)
+    return [round(north, decimals), round(west, decimals), round(south, decimals), round(east, decimals)]
@@ -0,0 +1,100 @@
+#%% Persistent station-to-grid index for the NetCDF extractors. Grid cells are found once
+# with a KD-tree and stored per grid definition, so the hot loop over thousands of files
+# neither loads the coordinate arrays nor searches for the nearest point again
+
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+STATION_INDEX_NAME = 'station_index.json'
+
+def grid_signature(ds):
+    """
+    Hash of the shape and corner values of the latitude/longitude variables of an open dataset.
+    Only a handful of values are read, so this is cheap to compute for every file.
+    """
+    parts = []
+    for name in ('latitude', 'longitude'):
+        var = ds.variables[name]
+        corners = [float(var[index]) for index in itertools.product(*[(0, size - 1) for size in var.shape])]
+        parts.append([name, list(var.shape), corners])
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()[:16]
+
+def station_key(station):
+    return f"{station['latitude']:.6f},{station['longitude']:.6f}"
+
+class StationIndex:
+    """
+    Grid indices of stations keyed by grid signature, saved as JSON next to the data.
+    """
+    def __init__(self, index_path, read_only=False):
+        self.index_path = str(index_path)
+        self.read_only = read_only
+        self.entries = {}
+        self._trees = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                self.entries = json.load(f)
+
+    def locate(self, ds, stations):
+        """
+        Entries (lat_idx, lon_idx, latitude, longitude, exact) of each station in an open dataset.
+        The coordinates are only loaded when the grid or a station has not been seen before.
+        """
+        signature = grid_signature(ds)
+        grid_entries = self.entries.setdefault(signature, {})
+        missing = [station for station in stations if station_key(station) not in grid_entries]
+
+        if missing:
+            tree, latitudes, longitudes = self._tree(ds, signature)
+            for station in missing:
+                distance, flat_index = tree.query([station['latitude'], station['longitude']])
+                lat_idx, lon_idx = np.unravel_index(flat_index, latitudes.shape)
+                grid_entries[station_key(station)] = {
+                    'lat_idx': int(lat_idx),
+                    'lon_idx': int(lon_idx),
+                    'latitude': float(latitudes[lat_idx, lon_idx]),
+                    'longitude': float(longitudes[lat_idx, lon_idx]),
+                    'exact': bool(distance == 0),
+                }
+            self._save()
+
+        return [grid_entries[station_key(station)] for station in stations]
+
+    def _tree(self, ds, signature):
+        # Build the KD-tree over the grid once per signature, 1D axes are expanded to a mesh
+        if signature not in self._trees:
+            latitudes = np.asarray(ds.variables['latitude'][:], dtype=float)
+            longitudes = np.asarray(ds.variables['longitude'][:], dtype=float)
+            if latitudes.ndim == 1:
+                latitudes, longitudes = np.meshgrid(latitudes, longitudes, indexing='ij')
+            tree = cKDTree(np.column_stack([latitudes.ravel(), longitudes.ravel()]))
+            self._trees[signature] = (tree, latitudes, longitudes)
+        return self._trees[signature]
+
+    def read_only_copy(self):
+        """
+        Copy for worker processes, new grids are located in memory and never saved.
+        """
+        copy = StationIndex.__new__(StationIndex)
+        copy.__dict__.update(self.__getstate__(), read_only=True, entries=json.loads(json.dumps(self.entries)))
+        return copy
+
+    def _save(self):
+        if self.read_only:
+            return
+        # Unique temporary name, two runs may save the index at the same time
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def __getstate__(self):
+        # The KD-trees are rebuilt on demand in worker processes instead of being pickled
+        state = self.__dict__.copy()
+        state['_trees'] = {}
+        return state
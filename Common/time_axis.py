@@ -0,0 +1,71 @@
+#%% Vectorized decoding of NetCDF time axes to datetime64 and bulk date formatting, in place
+# of nc.num2date followed by a datetime per value and a strftime per row
+
+import functools
+import re
+
+import netCDF4 as nc
+import numpy as np
+
+# Calendars that match numpy's proleptic Gregorian datetime64 for the dates of these archives
+NUMPY_CALENDARS = ('standard', 'gregorian', 'proleptic_gregorian')
+UNIT_STEPS = {
+    'days': np.timedelta64(86400, 's'),
+    'hours': np.timedelta64(3600, 's'),
+    'minutes': np.timedelta64(60, 's'),
+    'seconds': np.timedelta64(1, 's'),
+}
+UNITS_PATTERN = re.compile(r'^\s*(\w+)\s+since\s+(\d{4}-\d{1,2}-\d{1,2})(?:[ T](\d{1,2}:\d{1,2}(?::\d{1,2})?))?')
+
+@functools.lru_cache(maxsize=None)
+def parse_units(units, calendar='standard'):
+    """
+    Origin and step of CF time units as datetime64/timedelta64, cached per units and calendar.
+    Returns None when the axis cannot be decoded with numpy and needs cftime.
+    """
+    match = UNITS_PATTERN.match(units)
+    if calendar not in NUMPY_CALENDARS or match is None or match.group(1) not in UNIT_STEPS:
+        return None
+    year, month, day = (int(part) for part in match.group(2).split('-'))
+    clock = [int(part) for part in (match.group(3) or '0:0').split(':')] + [0]
+    origin = np.datetime64(f"{year:04d}-{month:02d}-{day:02d}T{clock[0]:02d}:{clock[1]:02d}:{clock[2]:02d}", 's')
+    return origin, UNIT_STEPS[match.group(1)]
+
+def decode_values(values, units, calendar='standard'):
+    """
+    Decode numeric time values to a datetime64[s] array of the same shape.
+    """
+    values = np.ma.filled(np.ma.asarray(values), np.nan)
+    parsed = parse_units(units, calendar)
+    if parsed is None:
+        # Other calendars go through cftime, one value at a time as before
+        dates = nc.num2date(values, units=units, calendar=calendar)
+        return np.array([np.datetime64(f"{t.year:04d}-{t.month:02d}-{t.day:02d}T{t.hour:02d}:{t.minute:02d}:{t.second:02d}")
+                         for t in np.ravel(dates)], dtype='datetime64[s]').reshape(np.shape(dates))
+    origin, step = parsed
+    if np.issubdtype(values.dtype, np.integer):
+        return origin + values.astype(np.int64) * step
+    # Fractional values are rounded to the second, as num2date does
+    return origin + np.round(values * step.astype(np.int64)).astype(np.int64).astype('timedelta64[s]')
+
+def decode_time(time_var, default_calendar='standard'):
+    """
+    Decode an open NetCDF time variable to a datetime64[s] array.
+    """
+    return decode_values(time_var[:], time_var.units, getattr(time_var, 'calendar', default_calendar))
+
+def format_dates(dates, unit='h'):
+    """
+    Format datetime64 values as YYYYMMDDHH strings (unit='h') or YYYYMMDD strings (unit='D') in bulk.
+    """
+    dates = np.asarray(dates, dtype='datetime64[s]')
+    days = dates.astype('datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    years = dates.astype('datetime64[Y]').astype(np.int64) + 1970
+    number = (years * 100 + (months - dates.astype('datetime64[Y]')).astype(np.int64) + 1) * 100 \
+        + (days - months).astype(np.int64) + 1
+    if unit == 'h':
+        number = number * 100 + (dates - days).astype('timedelta64[h]').astype(np.int64)
+    elif unit != 'D':
+        raise ValueError(f"Unknown unit {unit}, expected 'h' or 'D'")
+    return number.astype(str)
@@ -0,0 +1,35 @@
+#%% Single-pass post-processing of the netcdf4.zip files returned by the CDS: the NetCDF
+# member is streamed straight to its final path, verified, and the zip is removed
+
+import os
+import shutil
+import zipfile
+
+from download_manifest import looks_complete
+
+COPY_BUFFER_SIZE = 8 * 1024 * 1024
+
+def stream_nc_from_zip(zip_path, output_nc_path, remove_zip=True):
+    """
+    Copy the NetCDF member of a CDS zip to output_nc_path in one pass and delete the zip.
+    """
+    part_path = output_nc_path + '.part'
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = [info for info in zip_ref.infolist() if info.filename.endswith('.nc')]
+        if not members:
+            raise OSError(f"No NetCDF file found in {zip_path}")
+        member = members[0]
+
+        # ZipExtFile checks the CRC once the member has been read to the end
+        with zip_ref.open(member) as src, open(part_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, COPY_BUFFER_SIZE)
+
+    # Only move the file into place once it has the expected size and a NetCDF signature
+    if os.path.getsize(part_path) != member.file_size or not looks_complete(part_path, '.nc'):
+        os.remove(part_path)
+        raise OSError(f"Extracted file from {zip_path} is incomplete")
+    os.replace(part_path, output_nc_path)
+
+    if remove_zip:
+        os.remove(zip_path)
+    return output_nc_path
@@ -2,6 +2,12 @@
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import os
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
 
 # Function to calculate CDF
 def calculate_cdf(data):
@@ -16,14 +22,12 @@ def filter_data_for_months_and_years(data, years, months):
 # Paths
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-# Load data
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Load data from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Define years and months of interest
 years_of_interest = [1991, 2018]
@@ -74,6 +78,12 @@ print(f'Reanalysis 33rd percentile: {rean_33rd} m³/s')
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import os
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
 
 # Function to calculate CDF
 def calculate_cdf(data):
@@ -81,36 +91,25 @@ def calculate_cdf(data):
     cdf = np.arange(1, len(sorted_data) + 1) / len(sorted_data)
     return sorted_data, cdf
 
-# Function to filter data for specific months and years
-def filter_data_for_months_and_years(data, years, months):
-    return data[(data['date'].dt.year.isin(years)) & (data['date'].dt.month.isin(months))]
-
 # Paths
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-# Load data
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Load data from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Define years and months of interest
 years_of_interest = [1991, 2018]
 summer_months = [6, 7, 8]  # June, July, August
 
-# Filter data for summer months
-obs_data_summer = filter_data_for_months_and_years(observed_data, years_of_interest, summer_months)
-rean_data_summer = filter_data_for_months_and_years(reanalysis_data, years_of_interest, summer_months)
-
-# Calculate monthly volumes
-obs_data_summer['month_year'] = obs_data_summer['date'].dt.to_period('M')
-rean_data_summer['month_year'] = rean_data_summer['date'].dt.to_period('M')
-
-obs_monthly_volume = obs_data_summer.groupby('month_year')['flow'].sum()
-rean_monthly_volume = rean_data_summer.groupby('month_year')['flow'].sum()
+# Calculate monthly volumes with the store's vectorized resampling, then keep the summer months
+obs_monthly_volume = store.resample('Q-Alazani-Shaqriani', 'M', 'sum')
+rean_monthly_volume = store.resample('Shakriani_EFAS_reanalysis', 'M', 'sum')
+obs_monthly_volume = obs_monthly_volume[obs_monthly_volume.index.year.isin(years_of_interest) & obs_monthly_volume.index.month.isin(summer_months)]
+rean_monthly_volume = rean_monthly_volume[rean_monthly_volume.index.year.isin(years_of_interest) & rean_monthly_volume.index.month.isin(summer_months)]
 
 # Calculate CDFs
 obs_sorted, obs_cdf = calculate_cdf(obs_monthly_volume)
@@ -5,15 +5,19 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.ticker import ScalarFormatter
+import os
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
 
 # Path to the .obs file
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-# Read the file
-data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=['date', 'discharge'])
-
-# Convert the 'date' column to datetime format
-data['date'] = pd.to_datetime(data['date'], format='%Y%m%d%H')
+# Read the series from the observation store, the .obs is parsed again only when it changes
+data = ObservationStore(obs_store_dir).add('Q-Alazani-Shaqriani', file_path, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'discharge'))
 
 # Remove negative discharge values
 data = data[data['discharge'] >= 0]
@@ -60,15 +64,19 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.ticker import ScalarFormatter
+import os
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
 
 # Path to the .obs file
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-# Read the file
-data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=['date', 'discharge'])
-
-# Convert the 'date' column to datetime format
-data['date'] = pd.to_datetime(data['date'], format='%Y%m%d%H')
+# Read the series from the observation store, the .obs is parsed again only when it changes
+data = ObservationStore(obs_store_dir).add('Q-Alazani-Shaqriani', file_path, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'discharge'))
 
 # Remove negative discharge values
 data = data[data['discharge'] >= 0]
@@ -1,76 +1,203 @@
 #%% Developmed by Deborah Dotta, June 2024
 
-import cdsapi
+import netCDF4 as nc
+import numpy as np
 import os
-import zipfile
+import sys
 
-def retrieve_efas_historical(year, month, output_folder):
-    c = cdsapi.Client()
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from download_manifest import DownloadManifest, MANIFEST_NAME, looks_complete
+from station_catalog import load_station_catalog, station_area
+from zip_stream import stream_nc_from_zip
+from cds_client_pool import ClientPool, TELEMETRY_NAME, shared_pool
 
+DATASET = 'efas-historical'
+FIELDS_PER_MONTH = 31 * 4  # Upper bound of 6-hourly maps in one month of a request
+DEFAULT_AREA = [43.5, 40, 40, 47.5]  # Georgia block used before the station catalog
+
+def build_request(year, month, area=None):
+    """
+    CDS request for the given hyear/hmonth, which may be single values or lists.
+    """
+    return {
+        'system_version': 'version_4_0',
+        'variable': 'river_discharge_in_the_last_6_hours',
+        'model_levels': 'surface_level',
+        'hyear': year,
+        'hmonth': month,
+        'hday': [
+            '01', '02', '03',
+            '04', '05', '06',
+            '07', '08', '09',
+            '10', '11', '12',
+            '13', '14', '15',
+            '16', '17', '18',
+            '19', '20', '21',
+            '22', '23', '24',
+            '25', '26', '27',
+            '28', '29', '30',
+            '31',
+        ],
+        'time': [
+            '00:00', '06:00', '12:00',
+            '18:00',
+        ],
+        'format': 'netcdf4.zip',
+        'area': area if area is not None else DEFAULT_AREA,
+    }
+
+def retrieve_efas_historical(year, month, output_folder, manifest=None, area=None, pool=None):
     output_zip_path = os.path.join(output_folder, f'{year}{month}_EFAS_historical.zip')
     output_nc_path = os.path.join(output_folder, f'{year}{month}_EFAS_historical.nc')
 
-    c.retrieve(
-        'efas-historical',
-        {
-            'system_version': 'version_4_0',
-            'variable': 'river_discharge_in_the_last_6_hours',
-            'model_levels': 'surface_level',
-            'hyear': year,
-            'hmonth': month,
-            'hday': [
-                '01', '02', '03',
-                '04', '05', '06',
-                '07', '08', '09',
-                '10', '11', '12',
-                '13', '14', '15',
-                '16', '17', '18',
-                '19', '20', '21',
-                '22', '23', '24',
-                '25', '26', '27',
-                '28', '29', '30',
-                '31',
-            ],
-            'time': [
-                '00:00', '06:00', '12:00',
-                '18:00',
-            ],
-            'format': 'netcdf4.zip',
-            'area': [
-                43.5, 40, 40,
-                47.5,
-            ],
-        },
-        output_zip_path)  # Save file in specified directory
-
-    # Unzip the downloaded file
-    with zipfile.ZipFile(output_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(output_folder)
-
-    # Get list of files extracted from the zip
-    extracted_files = zip_ref.namelist()
-
-    # Find the NetCDF file and rename it
-    for file in extracted_files:
-        if file.endswith('.nc'):
-            os.rename(os.path.join(output_folder, file), output_nc_path)
-            break
+    request = build_request(year, month, area)
+
+    # Skip months finished in a previous run, and only unzip again when the zip is intact
+    if manifest is not None and manifest.is_complete(output_nc_path, DATASET, request):
+        print(f"Year {year}, month {month} already downloaded, skipping")
+        return
+    zip_complete = manifest is not None and manifest.is_complete(output_zip_path, DATASET, request)
+
+    if not zip_complete:
+        pool = pool if pool is not None else shared_pool()
+        pool.retrieve(DATASET, request, output_zip_path)  # Save file in specified directory
+        if not looks_complete(output_zip_path):
+            raise OSError(f"Downloaded file is truncated: {output_zip_path}")
+        if manifest is not None:
+            manifest.record(output_zip_path, DATASET, request)
+
+    # Stream the NetCDF member straight to its final name and drop the zip
+    stream_nc_from_zip(output_zip_path, output_nc_path)
+
+    if manifest is not None:
+        manifest.record(output_nc_path, DATASET, request)
+
+def plan_coalesced_requests(year_months, max_fields):
+    """
+    Pack (year, month) pairs into (years, months) requests of at most max_fields 6-hourly maps.
+    """
+    months_per_request = max(1, max_fields // FIELDS_PER_MONTH)
+
+    months_by_year = {}
+    for year, month in year_months:
+        months_by_year.setdefault(year, []).append(month)
+
+    chunks = []
+    for year, months in sorted(months_by_year.items()):
+        for i in range(0, len(months), months_per_request):
+            chunks.append(([year], months[i:i + months_per_request]))
+
+    # The CDS crosses hyear with hmonth, so consecutive years asking for the same months share a request
+    groups = []
+    for years, months in chunks:
+        if groups and groups[-1][1] == months and (len(groups[-1][0]) + 1) * len(months) <= months_per_request:
+            groups[-1][0].extend(years)
+        else:
+            groups.append((years, months))
+    return groups
+
+def split_by_month(combined_nc_path, output_folder):
+    """
+    Split a multi-month NetCDF into the usual {year}{month}_EFAS_historical.nc files.
+    """
+    written = []
+    with nc.Dataset(combined_nc_path) as src:
+        # Copy raw values, the packing attributes are copied along with them
+        src.set_auto_maskandscale(False)
+        time_var = src.variables['time']
+        times = nc.num2date(time_var[:], units=time_var.units, calendar=getattr(time_var, 'calendar', 'standard'))
+        month_keys = np.array([t.year * 100 + t.month for t in times])
+
+        for month_key in np.unique(month_keys):
+            indices = np.where(month_keys == month_key)[0]
+            time_slice = slice(indices[0], indices[-1] + 1)  # Time is sorted, so each month is contiguous
+            year, month = divmod(int(month_key), 100)
+            output_nc_path = os.path.join(output_folder, f'{year}{month:02d}_EFAS_historical.nc')
+
+            with nc.Dataset(output_nc_path, 'w', format=src.file_format) as dst:
+                dst.setncatts({attr: src.getncattr(attr) for attr in src.ncattrs()})
+                for name, dim in src.dimensions.items():
+                    if dim.isunlimited():
+                        dst.createDimension(name, None)
+                    else:
+                        dst.createDimension(name, len(indices) if name == 'time' else len(dim))
+
+                for name, var in src.variables.items():
+                    fill_value = var.getncattr('_FillValue') if '_FillValue' in var.ncattrs() else None
+                    out_var = dst.createVariable(name, var.datatype, var.dimensions, zlib=True, fill_value=fill_value)
+                    # Switched off per variable, the dataset-wide switch does not reach variables created later
+                    out_var.set_auto_maskandscale(False)
+                    out_var.setncatts({attr: var.getncattr(attr) for attr in var.ncattrs() if attr != '_FillValue'})
+                    if 'time' in var.dimensions:
+                        slicer = tuple(time_slice if dim_name == 'time' else slice(None) for dim_name in var.dimensions)
+                    else:
+                        slicer = Ellipsis
+                    values = var[slicer]
+                    out_var[...] = values
+                    # The first month read back must hold the packed values of the combined file
+                    if not written and not np.array_equal(out_var[...], values, equal_nan=np.issubdtype(values.dtype, np.floating)):
+                        raise ValueError(f"Values of {name} in {output_nc_path} differ from {combined_nc_path}")
+
+            written.append((year, f'{month:02d}', output_nc_path))
+    return written
+
+def retrieve_efas_historical_coalesced(years, months, output_folder, manifest=None, area=None, pool=None):
+    """
+    Download several months in one CDS request and split the result into monthly files.
+    """
+    output_zip_path = os.path.join(output_folder, f'{years[0]}{months[0]}_{years[-1]}{months[-1]}_EFAS_historical_coalesced.zip')
+    request = build_request([str(year) for year in years], months, area)
+
+    pool = pool if pool is not None else shared_pool()
+    pool.retrieve(DATASET, request, output_zip_path)  # Save file in specified directory
+    if not looks_complete(output_zip_path):
+        raise OSError(f"Downloaded file is truncated: {output_zip_path}")
+
+    # Stream the combined NetCDF out of the zip and split it into the monthly layout
+    combined_nc_path = output_zip_path[:-len('.zip')] + '.nc'
+    stream_nc_from_zip(output_zip_path, combined_nc_path)
+    try:
+        written = split_by_month(combined_nc_path, output_folder)
+    finally:
+        os.remove(combined_nc_path)
+
+    # Record each month under its single-month request, so monthly and coalesced runs skip the same files
+    if manifest is not None:
+        for year, month, output_nc_path in written:
+            manifest.record(output_nc_path, DATASET, build_request(year, month, area))
 
 def main():
     start_year = int(input("Enter the start year (e.g., 2009): "))
     end_year = int(input("Enter the end year (e.g., 2020): "))
     start_month = int(input("Enter the start month (e.g., 1 for January): "))
     end_month = int(input("Enter the end month (e.g., 12 for December): "))
+    max_fields = int(input(f"Enter the request size budget in 6-hourly maps ({FIELDS_PER_MONTH} per month, 0 for one month per request): "))
     output_folder = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical"  # Specify output folder here
+    manifest = DownloadManifest(os.path.join(output_folder, MANIFEST_NAME))  # Lets a rerun skip finished months
+    area = station_area(load_station_catalog(), halo=2)  # Smallest box around the catalog stations
+    pool = ClientPool(1, os.path.join(output_folder, TELEMETRY_NAME))  # Logs timing of every request
+
+    if max_fields > FIELDS_PER_MONTH:
+        # Only pack the months that are not in the archive yet
+        pending = [(year, f'{month:02d}')
+                   for year in range(start_year, end_year + 1)
+                   for month in range(start_month, end_month + 1)
+                   if not manifest.is_complete(os.path.join(output_folder, f'{year}{month:02d}_EFAS_historical.nc'),
+                                               DATASET, build_request(year, f'{month:02d}', area))]
+        for years, months in plan_coalesced_requests(pending, max_fields):
+            print(f"Processing years {years[0]}-{years[-1]}, months {', '.join(months)}...")
+            retrieve_efas_historical_coalesced(years, months, output_folder, manifest, area, pool)
+        return
 
     for year in range(start_year, end_year + 1):
         for month in range(start_month, end_month + 1):
             month_str = f'{month:02d}'  # Format month as two digits
             print(f"Processing year {year}, month {month_str}...")
-            retrieve_efas_historical(year, month_str, output_folder)
+            retrieve_efas_historical(year, month_str, output_folder, manifest, area, pool)
 
 if __name__ == "__main__":
     main()
 
 
-#%%
\ No newline at end of file
+#%%
@@ -20,8 +20,18 @@ import numpy as np
 from datetime import datetime, timedelta
 import os
 import logging
+from contextlib import ExitStack
 from glob import glob
 
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from station_catalog import load_station_catalog, get_station
+from station_index import StationIndex, STATION_INDEX_NAME
+from efas_archive import read_point_series
+from time_axis import decode_time, decode_values, format_dates
+from extraction_watermark import Watermark
+from raw_reader import read_raw
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -46,13 +56,7 @@ def extract_discharge_data(file_path, point_lat, point_lon):
         latitudes = ds.variables['latitude'][:]
         longitudes = ds.variables['longitude'][:]
         
-        try:
-            lat_idx = np.where(latitudes == point_lat)[0][0]
-            lon_idx = np.where(longitudes == point_lon)[0][0]
-            exact_match = True
-        except IndexError:
-            exact_match = False
-            lat_idx, lon_idx = find_closest_lat_lon(latitudes, longitudes, point_lat, point_lon)
+        lat_idx, lon_idx, exact_match = locate_point(latitudes, longitudes, point_lat, point_lon)
         
         actual_lat = latitudes[lat_idx] if np.ndim(latitudes) == 1 else latitudes[lat_idx, lon_idx]
         actual_lon = longitudes[lon_idx] if np.ndim(longitudes) == 1 else longitudes[lat_idx, lon_idx]
@@ -62,82 +66,294 @@ def extract_discharge_data(file_path, point_lat, point_lon):
         else:
             logger.warning(f"Exact point not found. Closest point used. Latitude: {actual_lat}, Longitude: {actual_lon}")
         
-        dis6 = ds.variables['dis06'][:, lat_idx, lon_idx]
-        time = ds.variables['time'][:]
-        time_units = ds.variables['time'].units
-        
-        # Convert time to datetetime
-        times = nc.num2date(time, units=time_units, calendar='standard')
-        times = [datetime(t.year, t.month, t.day, t.hour, t.minute) for t in times]
+        # Raw read without masked arrays, fill values come back as NaN
+        dis6 = read_raw(ds.variables['dis06'], (slice(None), lat_idx, lon_idx))
+        # Decode time to datetime64 in one vectorized step
+        times = decode_time(ds.variables['time'])
         
         return dis6, times, actual_lat, actual_lon
 
-def write_discharge_data_to_txt(discharge, times, output_filename):
+def locate_point(latitudes, longitudes, point_lat, point_lon):
     """
-    Write the discharge data to a text file.
+    Grid indices of a station, exact match if possible, otherwise the closest grid point.
     """
-    with open(output_filename, 'a') as f:  # Append mode
-        daily_discharge = []
-        current_day = times[0].date()
-        daily_values = []
-        
-        for t, dis in zip(times, discharge):
-            if t.date() == current_day:
-                daily_values.append(dis)
-            else:
-                # Calculate daily mean discharge
-                mean_discharge = np.mean(daily_values)
-                f.write(f"{current_day.strftime('%Y%m%d')} {mean_discharge:.3f}\n")
-                
-                # Reset for the next day
-                current_day = t.date()
-                daily_values = [dis]
-        
-        # Write the last day
-        if daily_values:
-            mean_discharge = np.mean(daily_values)
-            f.write(f"{current_day.strftime('%Y%m%d')} {mean_discharge:.3f}\n")
+    try:
+        lat_idx = np.where(latitudes == point_lat)[0][0]
+        lon_idx = np.where(longitudes == point_lon)[0][0]
+        exact_match = True
+    except IndexError:
+        exact_match = False
+        lat_idx, lon_idx = find_closest_lat_lon(latitudes, longitudes, point_lat, point_lon)
+    return int(lat_idx), int(lon_idx), exact_match
+
+def locate_stations(ds, stations):
+    """
+    Grid indices and actual lat/lon of each station, searched in the coordinates of the file.
+    """
+    latitudes = ds.variables['latitude'][:]
+    longitudes = ds.variables['longitude'][:]
+
+    lat_indices = []
+    lon_indices = []
+    actual_lat_lons = []
+    for station in stations:
+        lat_idx, lon_idx, exact_match = locate_point(latitudes, longitudes, station['latitude'], station['longitude'])
+        actual_lat = latitudes[lat_idx] if np.ndim(latitudes) == 1 else latitudes[lat_idx, lon_idx]
+        actual_lon = longitudes[lon_idx] if np.ndim(longitudes) == 1 else longitudes[lat_idx, lon_idx]
+        if not exact_match:
+            logger.warning(f"Exact point not found for {station['station']}. Closest point used. Latitude: {actual_lat}, Longitude: {actual_lon}")
+        lat_indices.append(lat_idx)
+        lon_indices.append(lon_idx)
+        actual_lat_lons.append((actual_lat, actual_lon))
+    return lat_indices, lon_indices, actual_lat_lons
+
+def extract_discharge_data_batch(file_path, stations, station_index=None):
+    """
+    Extract discharge data for several stations from one NetCDF file with a single read.
+    Returns an array of shape (time, station), the times and the actual lat/lon per station.
+    With a station index the grid cells are looked up instead of searched for in every file.
+    """
+    with nc.Dataset(file_path) as ds:
+        if station_index is not None:
+            located = station_index.locate(ds, stations)
+            lat_indices = [entry['lat_idx'] for entry in located]
+            lon_indices = [entry['lon_idx'] for entry in located]
+            actual_lat_lons = [(entry['latitude'], entry['longitude']) for entry in located]
+        else:
+            lat_indices, lon_indices, actual_lat_lons = locate_stations(ds, stations)
+
+        # netCDF4 indexes each dimension independently, so read the sorted unique rows and
+        # columns in one call and pick the station cells out of that block afterwards
+        unique_lat, lat_pos = np.unique(lat_indices, return_inverse=True)
+        unique_lon, lon_pos = np.unique(lon_indices, return_inverse=True)
+        block = read_raw(ds.variables['dis06'], (slice(None), unique_lat, unique_lon))
+        dis6 = block[:, lat_pos, lon_pos]
+
+        # Decode time to datetime64 in one vectorized step
+        times = decode_time(ds.variables['time'])
+
+        return dis6, times, actual_lat_lons
+
+class DailyAggregator:
+    """
+    Reduce 6-hourly discharge to daily values with grouped numpy reductions and write them in bulk.
+    The last day of every chunk is held back, so a day split over two monthly files gets one value.
+    A day holding a fill value (NaN) is written as nan, as np.mean over the day's values always did.
+    """
+    reductions = ('mean', 'min', 'max', 'sum')
+
+    def __init__(self, output_filename, reduction='mean', offset=None, state=None):
+        if reduction not in self.reductions:
+            raise ValueError(f"Unknown reduction {reduction}, expected one of {self.reductions}")
+        self.output_filename = output_filename
+        self.reduction = reduction
+        self.pending_values = np.empty(0)
+        self.pending_days = np.empty(0, dtype='datetime64[D]')
+        # Resume an earlier output at offset with the held back day of state, see state()
+        self.offset = offset
+        self.restore(state)
+        self.file = None
+
+    def __enter__(self):
+        if self.offset is None:
+            self.file = open(self.output_filename, 'w')
+        else:
+            self.file = open(self.output_filename, 'r+')
+            self.file.seek(self.offset)
+            self.file.truncate()
+        return self
+
+    def state(self):
+        """
+        Output offset and held back values as JSON-friendly data, to resume from in a later run.
+        """
+        values = [None if np.isnan(value) else float(value) for value in self.pending_values]
+        return self.file.tell(), [self.pending_days.astype(str).tolist(), values]
+
+    def restore(self, state):
+        """
+        Restore the held back values saved by state().
+        """
+        if state:
+            days, values = state
+            self.pending_days = np.array(days, dtype='datetime64[D]')
+            self.pending_values = np.array([np.nan if value is None else value for value in values], dtype=float)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, discharge, times):
+        """
+        Add one file worth of values and write every day that is now complete.
+        """
+        values = np.ma.filled(np.ma.asarray(discharge, dtype=float), np.nan).ravel()
+        days = np.asarray(times, dtype='datetime64[m]').astype('datetime64[D]')
+        values = np.concatenate([self.pending_values, values])
+        days = np.concatenate([self.pending_days, days])
+        if days.size == 0:
+            return
+
+        # Keep the last day back, the next file may still hold some of its values
+        last_day_start = np.searchsorted(days, days[-1])
+        self._write(values[:last_day_start], days[:last_day_start])
+        self.pending_values = values[last_day_start:]
+        self.pending_days = days[last_day_start:]
+
+    def close(self):
+        """
+        Write the day still held back and close the output file.
+        """
+        if self.file is None:
+            return
+        self._write(self.pending_values, self.pending_days)
+        self.pending_values = np.empty(0)
+        self.pending_days = np.empty(0, dtype='datetime64[D]')
+        self.file.close()
+        self.file = None
+
+    def _write(self, values, days):
+        if days.size == 0:
+            return
+
+        # Start of every run of equal days, the times are in chronological order.
+        # NaN propagates through every reduction, a day with a missing value has no daily value
+        starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+        if self.reduction == 'min':
+            daily = np.minimum.reduceat(values, starts)
+        elif self.reduction == 'max':
+            daily = np.maximum.reduceat(values, starts)
+        else:
+            daily = np.add.reduceat(values, starts)
+            if self.reduction == 'mean':
+                daily = daily / np.diff(np.r_[starts, days.size])
+
+        date_strings = format_dates(days[starts], unit='D')
+        self.file.write(''.join(f"{date} {value:.3f}\n" for date, value in zip(date_strings, daily)))
+
+def extract_stations(data_directory, stations, output_filenames, start_year, end_year, reduction='mean'):
+    """
+    Open each monthly file once and write one daily series per station to its output file.
+    """
+    # Grid cells of the stations, kept next to the data and reused across runs
+    station_index = StationIndex(os.path.join(data_directory, STATION_INDEX_NAME))
+
+    actual_lat_lons_used = None
+    with ExitStack() as stack:
+        # Opening the aggregators clears the output files if they exist
+        aggregators = [stack.enter_context(DailyAggregator(output_filenames[station['station']], reduction))
+                       for station in stations]
+
+        for year in range(start_year, end_year + 1):
+            for month in range(1, 13):
+                file_path = os.path.join(data_directory, f"{year}{month:02d}_EFAS_historical.nc")
+                if not os.path.exists(file_path):
+                    logger.error(f"No file found: {file_path}")
+                    continue
+
+                discharge, times, actual_lat_lons = extract_discharge_data_batch(file_path, stations, station_index)
+                logger.info(f"Discharge data dimensions for {month:02d}/{year}: {discharge.shape}")
+                if actual_lat_lons_used is None:
+                    actual_lat_lons_used = actual_lat_lons
+
+                for column, aggregator in enumerate(aggregators):
+                    aggregator.add(discharge[:, column], times)
+
+    # Log the actual lat/lon used per station
+    if actual_lat_lons_used is not None:
+        for station, actual_lat_lon in zip(stations, actual_lat_lons_used):
+            logger.info(f"Actual latitude and longitude used for {station['station']}: {actual_lat_lon}")
+
+def extract_stations_incremental(data_directory, stations, output_filenames, start_year, end_year, reduction='mean'):
+    """
+    Like extract_stations, but continue each station's output from its watermark: unchanged
+    months are skipped, new months are appended and a changed month is rewritten with all after it.
+    """
+    station_index = StationIndex(os.path.join(data_directory, STATION_INDEX_NAME))
+    file_paths = [os.path.join(data_directory, f"{year}{month:02d}_EFAS_historical.nc")
+                  for year in range(start_year, end_year + 1) for month in range(1, 13)]
+    file_paths = [file_path for file_path in file_paths if os.path.exists(file_path)]
+
+    with ExitStack() as stack:
+        watermarks, aggregators, resume_indices = [], [], []
+        for station in stations:
+            params = {'latitude': station['latitude'], 'longitude': station['longitude'], 'reduction': reduction}
+            watermark = Watermark(output_filenames[station['station']], params)
+            resume_index, offset, state = watermark.resume_point(file_paths)
+            watermarks.append(watermark)
+            resume_indices.append(resume_index)
+            aggregators.append(stack.enter_context(DailyAggregator(output_filenames[station['station']], reduction, offset, state)))
+        logger.info(f"{len(file_paths) - min(resume_indices, default=0)} of {len(file_paths)} files to extract")
+
+        for file_index in range(min(resume_indices, default=0), len(file_paths)):
+            file_path = file_paths[file_index]
+            pending = [column for column, resume_index in enumerate(resume_indices) if file_index >= resume_index]
+            discharge, times, actual_lat_lons = extract_discharge_data_batch(file_path, [stations[column] for column in pending], station_index)
+            logger.info(f"Discharge data dimensions for {os.path.basename(file_path)}: {discharge.shape}")
+            for position, column in enumerate(pending):
+                offset_before, state_before = aggregators[column].state()
+                aggregators[column].add(discharge[:, position], times)
+                watermarks[column].record(file_path, offset_before, state_before, *aggregators[column].state())
+
+def extract_stations_from_archive(archive_path, stations, output_filenames, reduction='mean'):
+    """
+    Write one daily series per station from the consolidated archive (Common/efas_archive.py),
+    the whole period comes from a few chunk reads instead of one open per monthly file.
+    """
+    station_index = StationIndex(os.path.join(os.path.dirname(archive_path), STATION_INDEX_NAME))
+    discharge, time, time_units, calendar, located = read_point_series(archive_path, 'dis06', stations, station_index)
+    times = decode_values(time, time_units, calendar)
+
+    for column, (station, entry) in enumerate(zip(stations, located)):
+        with DailyAggregator(output_filenames[station['station']], reduction) as aggregator:
+            aggregator.add(discharge[:, column], times)
+        logger.info(f"Actual latitude and longitude used for {station['station']}: {(entry['latitude'], entry['longitude'])}")
 
 def main():
     # Define file paths and parameters
     data_directory = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical"
-    point_lat = 41.998
-    point_lon = 45.582
+    # Same catalog the downloader builds its request area from
+    station = get_station(load_station_catalog(), 'Shakriani')
+    point_lat = station['latitude']
+    point_lon = station['longitude']
     output_filename = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2009.txt"
+    incremental = False  # Only extract months that are new or changed since the last run
     
-    # Clear the output file if it exists
-    open(output_filename, 'w').close()
+    if incremental:
+        extract_stations_incremental(data_directory, [station], {station['station']: output_filename}, 1991, 2009)
+        return
     
     # Variable to store the actual lat/lon used
     actual_lat_lon_used = None
     
-    for year in range(1991, 2010):
-        for month in range(1, 13):
-            file_pattern = os.path.join(data_directory, f"{year}{month:02d}_EFAS_historical.nc")
-            matching_files = glob(file_pattern)
-            
-            # Debugging: Check the file pattern and matching files
-            logger.info(f"Searching for files with pattern: {file_pattern}")
-            logger.info(f"Found files: {matching_files}")
-            
-            if not matching_files:
-                logger.error(f"No files found for pattern: {file_pattern}")
-                continue
-            
-            file_path = matching_files[0]
-            
-            # Extract discharge data
-            discharge, times, actual_lat, actual_lon = extract_discharge_data(file_path, point_lat, point_lon)
-            logger.info(f"Discharge data dimensions for {month:02d}/{year}: {discharge.shape}")
-            
-            # Store the actual lat/lon used
-            if actual_lat_lon_used is None:
-                actual_lat_lon_used = (actual_lat, actual_lon)
-            
-            # Write discharge data to text file
-            write_discharge_data_to_txt(discharge, times, output_filename)
-            logger.info(f"Discharge data saved to {output_filename}")
-    
+    # Opening the aggregator clears the output file if it exists
+    with DailyAggregator(output_filename) as aggregator:
+        for year in range(1991, 2010):
+            for month in range(1, 13):
+                file_pattern = os.path.join(data_directory, f"{year}{month:02d}_EFAS_historical.nc")
+                matching_files = glob(file_pattern)
+                
+                # Debugging: Check the file pattern and matching files
+                logger.info(f"Searching for files with pattern: {file_pattern}")
+                logger.info(f"Found files: {matching_files}")
+                
+                if not matching_files:
+                    logger.error(f"No files found for pattern: {file_pattern}")
+                    continue
+                
+                file_path = matching_files[0]
+                
+                # Extract discharge data
+                discharge, times, actual_lat, actual_lon = extract_discharge_data(file_path, point_lat, point_lon)
+                logger.info(f"Discharge data dimensions for {month:02d}/{year}: {discharge.shape}")
+                
+                # Store the actual lat/lon used
+                if actual_lat_lon_used is None:
+                    actual_lat_lon_used = (actual_lat, actual_lon)
+                
+                # Daily means are written as soon as each day is complete, also across files
+                aggregator.add(discharge, times)
+                logger.info(f"Discharge data saved to {output_filename}")
+        
     # Log the actual lat/lon used
     if actual_lat_lon_used is not None:
         logger.info(f"Actual latitude and longitude used for extraction: {actual_lat_lon_used}")
@@ -147,4 +363,15 @@ if __name__ == "__main__":
 
 
 
+#%% Extract every station of the catalog in a single pass over the archive
+# data_directory = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical"
+# stations = load_station_catalog()
+# output_filenames = {station['station']: os.path.join(data_directory, 'output', f"discharge_data_{station['station']}_1991_2018.txt")
+#                     for station in stations}
+# extract_stations(data_directory, stations, output_filenames, 1991, 2018)
+# Same output from the consolidated archive, see Common/efas_archive.py
+# extract_stations_from_archive(os.path.join(data_directory, 'EFAS_historical_archive.nc'), stations, output_filenames)
+
+
+
 #%%
\ No newline at end of file
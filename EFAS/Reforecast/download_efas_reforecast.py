@@ -1,59 +1,136 @@
 #%% Developmed by Deborah Dotta, May 2024
 
-import cdsapi
 import os
-import zipfile
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def retrieve_efas_seasonal_reforecast(year, month, output_folder):
-    c = cdsapi.Client()
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from download_manifest import DownloadManifest, MANIFEST_NAME, looks_complete
+from station_catalog import load_station_catalog, station_area
+from zip_stream import stream_nc_from_zip
+from cds_client_pool import ClientPool, TELEMETRY_NAME, shared_pool
 
+DATASET = 'efas-seasonal-reforecast'
+DEFAULT_AREA = [43.5, 40, 40, 47.5]  # Georgia block used before the station catalog
+
+def build_request(year, month, area=None):
     leadtimes = list(range(24, 5161, 24))  # Generate lead times from 24 to 5160 hours in steps of 24 hours
+    return {
+        'system_version': 'version_4_0',
+        'variable': 'river_discharge_in_the_last_24_hours',
+        'model_levels': 'surface_level',
+        'hyear': year,
+        'hmonth': month,
+        'leadtime_hour': leadtimes,
+        'format': 'netcdf4.zip',
+        'area': area if area is not None else DEFAULT_AREA,
+    }
 
+def output_paths(year, month, output_folder):
     output_zip_path = os.path.join(output_folder, f'{year}{month}_EFAS_seasonal_reforecast.zip')
     output_nc_path = os.path.join(output_folder, f'{year}{month}_EFAS_seasonal_reforecast.nc')
+    return output_zip_path, output_nc_path
+
+def already_downloaded(year, month, output_folder, manifest=None, area=None):
+    """
+    True when the manifest records the month's NetCDF as finished for the same request.
+    """
+    output_nc_path = output_paths(year, month, output_folder)[1]
+    return manifest is not None and manifest.is_complete(output_nc_path, DATASET, build_request(year, month, area))
+
+def retrieve_efas_seasonal_reforecast(year, month, output_folder, pool=None, manifest=None, area=None):
+    output_zip_path, output_nc_path = output_paths(year, month, output_folder)
+    request = build_request(year, month, area)
+
+    # Skip months finished in a previous run, and only unzip again when the zip is intact
+    if manifest is not None and manifest.is_complete(output_nc_path, DATASET, request):
+        print(f"Year {year}, month {month} already downloaded, skipping")
+        return output_nc_path
+    zip_complete = manifest is not None and manifest.is_complete(output_zip_path, DATASET, request)
+
+    if not zip_complete:
+        pool = pool if pool is not None else shared_pool()
+        pool.retrieve(DATASET, request, output_zip_path)  # Save file in specified directory
+        if not looks_complete(output_zip_path):
+            raise OSError(f"Downloaded file is truncated: {output_zip_path}")
+        if manifest is not None:
+            manifest.record(output_zip_path, DATASET, request)
+
+    # Stream the NetCDF member straight to its final name and drop the zip
+    stream_nc_from_zip(output_zip_path, output_nc_path)
+
+    if manifest is not None:
+        manifest.record(output_nc_path, DATASET, request)
+
+    return output_nc_path
 
-    c.retrieve(
-        'efas-seasonal-reforecast',
-        {
-            'system_version': 'version_4_0',
-            'variable': 'river_discharge_in_the_last_24_hours',
-            'model_levels': 'surface_level',
-            'hyear': year,
-            'hmonth': month,
-            'leadtime_hour': leadtimes,
-            'format': 'netcdf4.zip',
-            'area': [
-                43.5, 40, 40,
-                47.5,
-            ],
-        },
-        output_zip_path)  # Save file in specified directory
-
-    # Unzip the downloaded file
-    with zipfile.ZipFile(output_zip_path, 'r') as zip_ref:
-        zip_ref.extractall(output_folder)
-
-    # Get list of files extracted from the zip
-    extracted_files = zip_ref.namelist()
-
-    # Find the NetCDF file and rename it
-    for file in extracted_files:
-        if file.endswith('.nc'):
-            os.rename(os.path.join(output_folder, file), output_nc_path)
-            break
+def retrieve_concurrently(year_months, output_folder, max_workers=4, pool=None, manifest=None, area=None):
+    """
+    Keep up to max_workers requests in the CDS queue and extract each month as soon as it finishes.
+    """
+    if pool is None:
+        pool = ClientPool(max_workers, os.path.join(output_folder, TELEMETRY_NAME))
+
+    # Months finished in a previous run are reported apart, they would inflate the throughput
+    skipped = [(year, month) for year, month in year_months if already_downloaded(year, month, output_folder, manifest, area)]
+    for year, month in skipped:
+        print(f"Year {year}, month {month} already downloaded, skipping")
+    to_fetch = [year_month for year_month in year_months if year_month not in skipped]
+
+    start_time = time.perf_counter()
+    total_bytes = 0
+    completed = 0
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(retrieve_efas_seasonal_reforecast, year, month, output_folder, pool, manifest, area): (year, month)
+            for year, month in to_fetch
+        }
+        for future in as_completed(futures):
+            year, month = futures[future]
+            try:
+                output_nc_path = future.result()
+            except Exception as e:
+                print(f"Failed year {year}, month {month}: {e}")
+                continue
+
+            completed += 1
+            total_bytes += os.path.getsize(output_nc_path)
+            print(f"Finished year {year}, month {month} ({completed}/{len(futures)})")
+
+    # Report aggregate throughput over the months fetched in this run
+    elapsed = time.perf_counter() - start_time
+    if completed:
+        print(f"Downloaded {completed} months, {total_bytes / 1e6:.1f} MB in {elapsed:.1f} s "
+              f"({completed / elapsed * 3600:.1f} months/hour, {total_bytes / 1e6 / elapsed:.2f} MB/s)")
+    else:
+        print("Downloaded 0 months")
+    print(f"Skipped {len(skipped)} months already downloaded")
 
 def main():
     start_year = int(input("Enter the start year (e.g., 1995): "))
     end_year = int(input("Enter the end year (e.g., 2020): "))
     start_month = int(input("Enter the start month (e.g., 5 for May): "))
     end_month = int(input("Enter the end month (e.g., 9 for September): "))
+    max_workers = int(input("Enter the number of requests to keep in flight (1 for one at a time): "))
     output_folder = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia"  # Specify output folder here
+    manifest = DownloadManifest(os.path.join(output_folder, MANIFEST_NAME))  # Lets a rerun skip finished months
+    area = station_area(load_station_catalog(), halo=2)  # Smallest box around the catalog stations
+    pool = ClientPool(max_workers, os.path.join(output_folder, TELEMETRY_NAME))  # Logs timing of every request
+
+    year_months = [(year, f'{month:02d}')  # Format month as two digits
+                   for year in range(start_year, end_year + 1)
+                   for month in range(start_month, end_month + 1)]
+
+    if max_workers > 1:
+        retrieve_concurrently(year_months, output_folder, max_workers, pool, manifest, area)
+        return
 
-    for year in range(start_year, end_year + 1):
-        for month in range(start_month, end_month + 1):
-            month_str = f'{month:02d}'  # Format month as two digits
-            print(f"Processing year {year}, month {month_str}...")
-            retrieve_efas_seasonal_reforecast(year, month_str, output_folder)
+    for year, month_str in year_months:
+        print(f"Processing year {year}, month {month_str}...")
+        retrieve_efas_seasonal_reforecast(year, month_str, output_folder, pool, manifest, area)
 
 if __name__ == "__main__":
     main()
@@ -2,10 +2,26 @@
 import netCDF4 as nc
 import numpy as np
 import os
+import sys
+import time
 import logging
-from datetime import datetime
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from glob import glob
 
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Common'))
+from station_catalog import load_station_catalog, get_station
+from station_index import StationIndex, STATION_INDEX_NAME
+from fcst_writer import write_fcst_rows
+from efas_archive import read_point_series
+from time_axis import decode_time, decode_values, format_dates
+from extraction_watermark import Watermark
+from raw_reader import PointBuffer, read_raw
+from ensemble_cube import EnsembleCube
+
+MISSING_TOKEN = '--'  # Written for fill values, the text the f-string gave masked values
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,46 +38,95 @@ def find_closest_lat_lon(latitudes, longitudes, point_lat, point_lon):
     
     return min_idx
 
-def extract_forecast_data(file_path, point_lat, point_lon):
+def extract_forecast_data(file_path, point_lat, point_lon, station_index=None, buffer=None):
     """
     Extract forecast data from the NetCDF file.
+    With a station index the grid cell is looked up instead of searched for in every file.
+    With a PointBuffer the values are read into it, valid until the next file is read.
     """
     try:
         with nc.Dataset(file_path) as ds:
-            latitudes = ds.variables['latitude'][:]
-            longitudes = ds.variables['longitude'][:]
-            
-            try:
-                lat_idx = np.where(latitudes == point_lat)[0][0]
-                lon_idx = np.where(longitudes == point_lon)[0][0]
-                exact_match = True
-            except IndexError:
-                exact_match = False
-                lat_idx, lon_idx = find_closest_lat_lon(latitudes, longitudes, point_lat, point_lon)
-            
-            actual_lat = latitudes[lat_idx] if np.ndim(latitudes) == 1 else latitudes[lat_idx, lon_idx]
-            actual_lon = longitudes[lon_idx] if np.ndim(longitudes) == 1 else longitudes[lat_idx, lon_idx]
+            if station_index is not None:
+                entry = station_index.locate(ds, [{'latitude': point_lat, 'longitude': point_lon}])[0]
+                lat_idx, lon_idx = entry['lat_idx'], entry['lon_idx']
+                actual_lat, actual_lon = entry['latitude'], entry['longitude']
+                exact_match = entry['exact']
+            else:
+                latitudes = ds.variables['latitude'][:]
+                longitudes = ds.variables['longitude'][:]
+                
+                try:
+                    lat_idx = np.where(latitudes == point_lat)[0][0]
+                    lon_idx = np.where(longitudes == point_lon)[0][0]
+                    exact_match = True
+                except IndexError:
+                    exact_match = False
+                    lat_idx, lon_idx = find_closest_lat_lon(latitudes, longitudes, point_lat, point_lon)
+                
+                actual_lat = latitudes[lat_idx] if np.ndim(latitudes) == 1 else latitudes[lat_idx, lon_idx]
+                actual_lon = longitudes[lon_idx] if np.ndim(longitudes) == 1 else longitudes[lat_idx, lon_idx]
             
             if exact_match:
                 logger.info(f"Exact point found. Latitude: {actual_lat}, Longitude: {actual_lon}")
             else:
                 logger.warning(f"Exact point not found. Closest point used. Latitude: {actual_lat}, Longitude: {actual_lon}")
             
-            dis24 = ds.variables['dis24'][:, :, lat_idx, lon_idx]
+            # Raw read without masked arrays, fill values come back as NaN
+            key = (slice(None), slice(None), lat_idx, lon_idx)
+            dis24 = buffer.read(ds.variables['dis24'], key) if buffer is not None else read_raw(ds.variables['dis24'], key)
             step = ds.variables['step'][:]
             ensemble = ds.variables['number'][:]
-            valid_time_units = ds.variables['valid_time'].units
-            valid_time_values = ds.variables['valid_time'][:]
-            # Convert valid_time to datetime
-            time = nc.num2date(valid_time_values, units=valid_time_units, calendar='proleptic_gregorian')
-            # Convert cftime to datetime using list comprehension
-            time = [datetime(t.year, t.month, t.day, t.hour, t.minute, t.second) for t in time]
+            # Decode valid_time to datetime64 in one vectorized step
+            time = decode_time(ds.variables['valid_time'], 'proleptic_gregorian')
             
             return dis24, step, ensemble, time, actual_lat, actual_lon
     except OSError as e:
         logger.error(f"Error reading file {file_path}: {e}")
         return None, None, None, None, None, None
 
+def extract_forecast_file(args):
+    """
+    Process pool entry point, unpacks the arguments of extract_forecast_data.
+    """
+    return extract_forecast_data(*args)
+
+def extract_parallel(file_paths, point_lat, point_lon, max_workers, station_index=None):
+    """
+    Extract the files on a process pool and yield the results in the order of file_paths.
+    At most two files per worker are in flight, so finished results never pile up in memory.
+    Workers get a read-only copy of station_index, see prepare_station_index.
+    """
+    worker_index = station_index.read_only_copy() if station_index is not None else None
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for file_path in file_paths:
+            pending.append(executor.submit(extract_forecast_file, (file_path, point_lat, point_lon, worker_index)))
+            if len(pending) >= 2 * max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def prepare_station_index(file_paths, point_lat, point_lon, station_index):
+    """
+    Locate the point on the grid of every file in this process, so the index is complete and saved
+    once before a process pool starts. Only the coordinate corners are read from files on a known grid.
+    """
+    for file_path in file_paths:
+        try:
+            with nc.Dataset(file_path) as ds:
+                station_index.locate(ds, [{'latitude': point_lat, 'longitude': point_lon}])
+        except OSError as e:
+            logger.error(f"Error reading file {file_path}: {e}")
+
+def write_forecast_rows(fcst_file, forecast_data, forecast_steps, forecast_times):
+    """
+    Write the rows of one forecast file to an open .fcst file.
+    """
+    # forecast_data is (member, step), the .fcst has one row per step, fill values are written
+    # as -- like the formatted masked values were before
+    write_fcst_rows(fcst_file, format_dates(forecast_times), np.asarray(forecast_steps), forecast_data.T, member_format='%.1f',
+                    missing=MISSING_TOKEN)
+
 def write_forecast_to_file(fcst_filename, forecast_data_list, forecast_steps_list, forecast_times_list):
     """
     Write forecast data to a .fcst file.
@@ -70,57 +135,172 @@ def write_forecast_to_file(fcst_filename, forecast_data_list, forecast_steps_lis
         for forecast_data, forecast_steps, forecast_times in zip(forecast_data_list, forecast_steps_list, forecast_times_list):
             if forecast_data is None:
                 continue
-            num_time_steps = forecast_steps.size
-            num_ensemble_members = forecast_data.shape[0]
+            write_forecast_rows(fcst_file, forecast_data, forecast_steps, forecast_times)
 
-            for time_step in range(num_time_steps):
-                leadtime_hours = int(forecast_steps[time_step])
-                forecast_date = forecast_times[time_step]
-                date_str = forecast_date.strftime('%Y%m%d%H')
+def write_forecast_parallel(fcst_filename, file_paths, point_lat, point_lon, max_workers, station_index=None):
+    """
+    Extract the files on a process pool and write each one as soon as its turn comes,
+    so the .fcst stays in the chronological order of file_paths.
+    """
+    if station_index is not None:
+        prepare_station_index(file_paths, point_lat, point_lon, station_index)
+    with open(fcst_filename, 'w') as fcst_file:
+        results = extract_parallel(file_paths, point_lat, point_lon, max_workers, station_index)
+        for file_path, (forecast_data, forecast_steps, ensemble_members, forecast_times, actual_lat, actual_lon) in zip(file_paths, results):
+            if forecast_data is None:
+                continue
+            logger.info(f"Forecast data dimensions for {os.path.basename(file_path)}: {forecast_data.shape}")
+            write_forecast_rows(fcst_file, forecast_data, forecast_steps, forecast_times)
 
-                forecasts = ' '.join(f'{forecast_data[ensemble_member, time_step]:.1f}' for ensemble_member in range(num_ensemble_members))
-                fcst_file.write(f"{date_str} {leadtime_hours} {forecasts}\n")
+def write_forecast_incremental(fcst_filename, file_paths, point_lat, point_lon, station_index=None):
+    """
+    Continue the .fcst from its watermark: unchanged months are skipped, new months are
+    appended and a changed month is rewritten together with every month after it.
+    """
+    watermark = Watermark(fcst_filename, {'latitude': point_lat, 'longitude': point_lon})
+    resume_index, offset, _ = watermark.resume_point(file_paths)
+    logger.info(f"{len(file_paths) - resume_index} of {len(file_paths)} files to extract")
+
+    buffer = PointBuffer()
+    with open(fcst_filename, 'w' if offset is None else 'r+') as fcst_file:
+        fcst_file.seek(offset or 0)
+        fcst_file.truncate()
+        for file_path in file_paths[resume_index:]:
+            forecast_data, forecast_steps, ensemble_members, forecast_times, actual_lat, actual_lon = extract_forecast_data(file_path, point_lat, point_lon, station_index, buffer)
+            if forecast_data is None:
+                # Stop at the unreadable month, the next run resumes from it
+                break
+            offset_before = fcst_file.tell()
+            write_forecast_rows(fcst_file, forecast_data, forecast_steps, forecast_times)
+            watermark.record(file_path, offset_before, None, fcst_file.tell(), None)
+
+def write_forecast_cube(cube_directory, file_paths, point_lat, point_lon, station_index=None):
+    """
+    Extract the files straight into an ensemble cube (Common/ensemble_cube.py), one init per file.
+    """
+    buffer = PointBuffer()
+    cube = None
+    position = 0
+    for file_path in file_paths:
+        forecast_data, forecast_steps, ensemble_members, forecast_times, actual_lat, actual_lon = extract_forecast_data(file_path, point_lat, point_lon, station_index, buffer)
+        if forecast_data is None:
+            continue
+        if cube is None:
+            cube = EnsembleCube.create(cube_directory, len(file_paths), forecast_steps, forecast_data.shape[0])
+        # forecast_data is (member, step), the cube holds (lead, member) per init
+        cube.write(position, forecast_times[0], forecast_data.T)
+        position += 1
+    if cube is not None:
+        cube.flush()
+    return cube
+
+def write_forecast_from_archive(fcst_filename, archive_path, point_lat, point_lon, station_index):
+    """
+    Write the .fcst from the consolidated archive (Common/efas_archive.py), reading the
+    series of all initialisations at the point in a few chunk reads.
+    """
+    station = {'latitude': point_lat, 'longitude': point_lon}
+    dis24, valid_time, valid_time_units, calendar, located = read_point_series(archive_path, 'dis24', [station], station_index, 'valid_time')
+    logger.info(f"Actual latitude used: {located[0]['latitude']}, Actual longitude used: {located[0]['longitude']}")
+    with nc.Dataset(archive_path) as archive:
+        forecast_steps = archive.variables['step'][:]
+
+    with open(fcst_filename, 'w') as fcst_file:
+        for forecast_data, forecast_times in zip(dis24[..., 0], decode_values(valid_time, valid_time_units, calendar)):
+            write_forecast_rows(fcst_file, forecast_data, forecast_steps, forecast_times)
+
+def benchmark_workers(file_paths, point_lat, point_lon, worker_counts=(1, 2, 4, 8)):
+    """
+    Time the extraction of file_paths with growing pool sizes and log the speedup over the first one.
+    """
+    baseline = None
+    for max_workers in worker_counts:
+        start_time = time.perf_counter()
+        for _ in extract_parallel(file_paths, point_lat, point_lon, max_workers):
+            pass
+        elapsed = time.perf_counter() - start_time
+        baseline = baseline or elapsed
+        logger.info(f"{max_workers} workers: {elapsed:.1f} s, {len(file_paths) / elapsed:.1f} files/s, speedup {baseline / elapsed:.2f}x")
 
 def main():
     # Define file paths and parameters
     data_directory = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia"
     start_year = 1991
     end_year = 2018
-    point_lat = 41.998
-    point_lon = 45.582
-    basin_name = "Alazani Basin - Shakriani Hydrological Station"
+    # Same catalog the downloader builds its request area from
+    station = get_station(load_station_catalog(), 'Shakriani')
+    point_lat = station['latitude']
+    point_lon = station['longitude']
+    basin_name = f"{station['basin']} Basin - {station['station']} Hydrological Station"
     destination_path = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\merged"
+    max_workers = 1  # Number of processes reading files, 1 reads them one by one, e.g. os.cpu_count() for a process pool
+    fcst_filename = os.path.join(destination_path, f"{basin_name}_reforecast_efas_{start_year}_{end_year}.fcst")
+    incremental = False  # Only extract months that are new or changed since the last run
+    # Grid cell of the station, kept next to the data and reused across files and runs
+    station_index = StationIndex(os.path.join(data_directory, STATION_INDEX_NAME))
     
-    all_forecast_data_list = []
-    all_forecast_steps_list = []
-    all_forecast_times_list = []
+    if incremental:
+        file_paths = [os.path.join(data_directory, f"{year}{month:02d}_EFAS_seasonal_reforecast.nc")
+                      for year in range(start_year, end_year + 1) for month in range(1, 13)]
+        write_forecast_incremental(fcst_filename, [file_path for file_path in file_paths if os.path.exists(file_path)],
+                                   point_lat, point_lon, station_index)
+        logger.info(f"All forecast data written to {fcst_filename}")
+        return
     
-    # Process each year's files
-    for year in range(start_year, end_year + 1):
-        for month in range(1, 13):
-            file_pattern = os.path.join(data_directory, f"{year}{month:02d}_EFAS_seasonal_reforecast.nc")
-            files_found = glob(file_pattern)
-            if files_found:
-                file_path = files_found[0]
-                # Extract forecast data
-                forecast_data, forecast_steps, ensemble_members, forecast_times, actual_lat, actual_lon = extract_forecast_data(file_path, point_lat, point_lon)
-                if forecast_data is not None:
-                    logger.info(f"Forecast data dimensions for {month:02d}/{year}: {forecast_data.shape}")
-                    logger.info(f"Number of time steps: {forecast_steps.size}, Number of ensemble members: {ensemble_members.size}")
-                    logger.info(f"Actual latitude used: {actual_lat}, Actual longitude used: {actual_lon}")
-                    
-                    all_forecast_data_list.append(forecast_data)
-                    all_forecast_steps_list.append(forecast_steps)
-                    all_forecast_times_list.append(forecast_times)
-            else:
-                logger.warning(f"No files found for pattern: {file_pattern}")
+    if max_workers > 1:
+        # Collect the monthly files in chronological order, the writer keeps that order
+        file_paths = []
+        for year in range(start_year, end_year + 1):
+            for month in range(1, 13):
+                file_path = os.path.join(data_directory, f"{year}{month:02d}_EFAS_seasonal_reforecast.nc")
+                if os.path.exists(file_path):
+                    file_paths.append(file_path)
+                else:
+                    logger.warning(f"No files found for pattern: {file_path}")
+        write_forecast_parallel(fcst_filename, file_paths, point_lat, point_lon, max_workers, station_index)
+        logger.info(f"All forecast data written to {fcst_filename}")
+        return
+    
+    # Stream each month to the .fcst as soon as it is extracted, so memory stays flat
+    # however long the period is, every month is read into the same buffer
+    buffer = PointBuffer()
+    with open(fcst_filename, 'w') as fcst_file:
+        # Process each year's files
+        for year in range(start_year, end_year + 1):
+            for month in range(1, 13):
+                file_pattern = os.path.join(data_directory, f"{year}{month:02d}_EFAS_seasonal_reforecast.nc")
+                files_found = glob(file_pattern)
+                if files_found:
+                    file_path = files_found[0]
+                    # Extract forecast data
+                    forecast_data, forecast_steps, ensemble_members, forecast_times, actual_lat, actual_lon = extract_forecast_data(file_path, point_lat, point_lon, station_index, buffer)
+                    if forecast_data is not None:
+                        logger.info(f"Forecast data dimensions for {month:02d}/{year}: {forecast_data.shape}")
+                        logger.info(f"Number of time steps: {forecast_steps.size}, Number of ensemble members: {ensemble_members.size}")
+                        logger.info(f"Actual latitude used: {actual_lat}, Actual longitude used: {actual_lon}")
+                        
+                        write_forecast_rows(fcst_file, forecast_data, forecast_steps, forecast_times)
+                else:
+                    logger.warning(f"No files found for pattern: {file_pattern}")
     
-    # Write all forecast data to a single .fcst file
-    fcst_filename = os.path.join(destination_path, f"{basin_name}_reforecast_efas_{start_year}_{end_year}.fcst")
-    write_forecast_to_file(fcst_filename, all_forecast_data_list, all_forecast_steps_list, all_forecast_times_list)
     logger.info(f"All forecast data written to {fcst_filename}")
 
 if __name__ == "__main__":
     main()
 
+#%% Benchmark: scaling of the extraction from 1 to N processes
+# file_paths = sorted(glob(os.path.join(r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia", "*_EFAS_seasonal_reforecast.nc")))
+# benchmark_workers(file_paths, 41.998, 45.582, worker_counts=(1, 2, 4, os.cpu_count()))
+
+#%% Ensemble cube of the reforecast for fast lookups of single forecasts, see Common/ensemble_cube.py
+# file_paths = sorted(glob(os.path.join(r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia", "*_EFAS_seasonal_reforecast.nc")))
+# cube = write_forecast_cube(os.path.join(r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia", "merged", "reforecast_efas.cube"), file_paths, 41.998, 45.582)
+# leads, members = cube.trace('2010-04-02', 24, 90)
+
+#%% Same .fcst from the consolidated archive, see Common/efas_archive.py
+# data_directory = r"C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia"
+# write_forecast_from_archive(os.path.join(data_directory, 'merged', 'reforecast_from_archive.fcst'),
+#                             os.path.join(data_directory, 'EFAS_seasonal_reforecast_archive.nc'), 41.998, 45.582,
+#                             StationIndex(os.path.join(data_directory, STATION_INDEX_NAME)))
+
 #%%
\ No newline at end of file
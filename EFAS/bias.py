@@ -4,6 +4,12 @@
 import pandas as pd
 import numpy as np
 import os
+import sys
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from fcst_writer import write_fcst_file, check_fcst_file
+from fcst_reader import read_fcst
+from observation_store import ObservationStore
 
 # Function to calculate CDF
 def calculate_cdf(data):
@@ -36,20 +42,18 @@ def bias_correction_qm(reforecast_data, rean_sorted, rean_cdf, obs_sorted, obs_c
 # Load the ensemble reforecast data
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\merged\Alazani Basin - Shakriani Hydrological Station_reforecast_efas_2006_2018.fcst'
 column_names = ["date", "lead_time"] + [f'ensemble_{i}' for i in range(1, 26)]
-usecols = list(range(27))  # Only read the first 27 columns
-reforecast_data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=column_names, usecols=usecols)
-reforecast_data['date'] = pd.to_datetime(reforecast_data['date'], format='%Y%m%d%H')
+# Only the first 27 columns are read; parsed once, later runs memory-map the binary sidecar next to the .fcst
+reforecast_data = read_fcst(file_path, names=column_names, n_members=25)
 
 # Load observed and reanalysis data
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Both series come from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Remove non-finite values
 observed_data = observed_data.replace([np.inf, -np.inf], np.nan).dropna()
@@ -77,8 +81,12 @@ corrected_dir = r'C:\Users\dottacor\Documents2\GitFiles\corrected'
 os.makedirs(corrected_dir, exist_ok=True)
 corrected_file_path = os.path.join(corrected_dir, 'corrected_reforecast_data_all.fcst')
 
-# Ensure the output format is consistent with the input format
-corrected_data.to_csv(corrected_file_path, index=False, sep=' ', header=False, float_format='%.1f')
+# Ensure the output format is consistent with the input format, dates as the yyyymmddhh strings formatted above
+corrected_members = corrected_data[[f'ensemble_{i}' for i in range(1, 26)]].values
+write_fcst_file(corrected_file_path, corrected_data['date'].to_numpy(dtype=str), corrected_data['lead_time'].values,
+                corrected_members, member_format='%.1f')
+# The written file must read back as the corrected forecasts
+check_fcst_file(corrected_file_path, reforecast_data['date'].values, corrected_data['lead_time'].values, corrected_members)
 
 print(f"Bias correction completed and saved to:", corrected_file_path)
 
@@ -115,24 +123,28 @@ import pandas as pd
 import numpy as np
 from pygam import LinearGAM, s
 import os
+import sys
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from fcst_writer import write_fcst_file, check_fcst_file
+from fcst_reader import read_fcst
+from observation_store import ObservationStore
 
 # Load the ensemble reforecast data
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\merged\Alazani Basin - Shakriani Hydrological Station_reforecast_efas_2006_2018.fcst'
 column_names = ["date", "lead_time"] + [f'ensemble_{i}' for i in range(1, 26)]
-usecols = list(range(27))  # Only read the first 27 columns
-reforecast_data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=column_names, usecols=usecols)
-reforecast_data['date'] = pd.to_datetime(reforecast_data['date'], format='%Y%m%d%H')
+# Only the first 27 columns are read; parsed once, later runs memory-map the binary sidecar next to the .fcst
+reforecast_data = read_fcst(file_path, names=column_names, n_members=25)
 
 # Load observed and reanalysis data
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Both series come from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Merge reanalysis and observed data on date
 merged_data = pd.merge(reanalysis_data, observed_data, on='date', suffixes=('_reanalysis', '_observed')).dropna()
@@ -186,8 +198,12 @@ corrected_dir = r'C:\Users\dottacor\Documents2\GitFiles\corrected'
 os.makedirs(corrected_dir, exist_ok=True)
 corrected_file_path = os.path.join(corrected_dir, 'corrected_reforecast_data_gam.fcst')
 
-# Ensure the output format is consistent with the input format
-corrected_data.to_csv(corrected_file_path, index=False, sep=' ', header=False, float_format='%.1f')
+# Ensure the output format is consistent with the input format, dates as the yyyymmddhh strings formatted above
+corrected_members = corrected_data[[f'ensemble_{i}' for i in range(1, 26)]].values
+write_fcst_file(corrected_file_path, corrected_data['date'].to_numpy(dtype=str), corrected_data['lead_time'].values,
+                corrected_members, member_format='%.1f')
+# The written file must read back as the corrected forecasts
+check_fcst_file(corrected_file_path, reforecast_data['date'].values, corrected_data['lead_time'].values, corrected_members)
 
 print(f"Bias correction completed and saved to:", corrected_file_path)
 
@@ -210,6 +226,13 @@ import pandas as pd
 import numpy as np
 from scipy.stats import gamma
 import matplotlib.pyplot as plt
+import os
+import sys
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from fcst_writer import write_fcst_file, check_fcst_file
+from fcst_reader import read_fcst
+from observation_store import ObservationStore
 
 # Function to calculate CDF
 def calculate_cdf(data):
@@ -263,20 +286,18 @@ def bias_correction_segmented_qm(reforecast_data, rean_sorted, rean_cdf, obs_sor
 # Load the ensemble reforecast data
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\merged\Alazani Basin - Shakriani Hydrological Station_reforecast_efas_2006_2018.fcst'
 column_names = ["date", "lead_time"] + [f'ensemble_{i}' for i in range(1, 26)]
-usecols = list(range(27))  # Only read the first 27 columns
-reforecast_data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=column_names, usecols=usecols)
-reforecast_data['date'] = pd.to_datetime(reforecast_data['date'], format='%Y%m%d%H')
+# Only the first 27 columns are read; parsed once, later runs memory-map the binary sidecar next to the .fcst
+reforecast_data = read_fcst(file_path, names=column_names, n_members=25)
 
 # Load observed and reanalysis data
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Both series come from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Remove non-finite values
 observed_data = observed_data.replace([np.inf, -np.inf], np.nan).dropna()
@@ -307,8 +328,12 @@ corrected_dir = r'C:\Users\dottacor\Documents2\GitFiles\corrected'
 os.makedirs(corrected_dir, exist_ok=True)
 corrected_file_path = os.path.join(corrected_dir, 'corrected_reforecast_data_segmented_qm.fcst')
 
-# Ensure the output format is consistent with the input format
-corrected_data.to_csv(corrected_file_path, index=False, sep=' ', header=False, float_format='%.1f')
+# Ensure the output format is consistent with the input format, dates as the yyyymmddhh strings formatted above
+corrected_members = corrected_data[[f'ensemble_{i}' for i in range(1, 26)]].values
+write_fcst_file(corrected_file_path, corrected_data['date'].to_numpy(dtype=str), corrected_data['lead_time'].values,
+                corrected_members, member_format='%.1f')
+# The written file must read back as the corrected forecasts
+check_fcst_file(corrected_file_path, reforecast_data['date'].values, corrected_data['lead_time'].values, corrected_members)
 
 print(f"Bias correction completed and saved to:", corrected_file_path)
 
@@ -332,6 +357,12 @@ import numpy as np
 from scipy.stats import gamma
 from statsmodels.tsa.arima.model import ARIMA
 import os
+import sys
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from fcst_writer import write_fcst_file, check_fcst_file
+from fcst_reader import read_fcst
+from observation_store import ObservationStore
 
 # Function to calculate CDF
 def calculate_cdf(data):
@@ -407,20 +438,18 @@ def bias_correction_segmented_qm(reforecast_data, rean_sorted, rean_cdf, obs_sor
 # Load the ensemble reforecast data
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\merged\Alazani Basin - Shakriani Hydrological Station_reforecast_efas_2006_2018.fcst'
 column_names = ["date", "lead_time"] + [f'ensemble_{i}' for i in range(1, 26)]
-usecols = list(range(27))  # Only read the first 27 columns
-reforecast_data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=column_names, usecols=usecols)
-reforecast_data['date'] = pd.to_datetime(reforecast_data['date'], format='%Y%m%d%H')
+# Only the first 27 columns are read; parsed once, later runs memory-map the binary sidecar next to the .fcst
+reforecast_data = read_fcst(file_path, names=column_names, n_members=25)
 
 # Load observed and reanalysis data
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Both series come from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Set the date column as index for observed data
 observed_data.set_index('date', inplace=True)
@@ -454,8 +483,12 @@ corrected_dir = r'C:\Users\dottacor\Documents2\GitFiles\corrected'
 os.makedirs(corrected_dir, exist_ok=True)
 corrected_file_path = os.path.join(corrected_dir, 'corrected_reforecast_data_segmented_qm_arima.fcst')
 
-# Ensure the output format is consistent with the input format
-corrected_data.to_csv(corrected_file_path, index=False, sep=' ', header=False, float_format='%.1f')
+# Ensure the output format is consistent with the input format, dates as the yyyymmddhh strings formatted above
+corrected_members = corrected_data[[f'ensemble_{i}' for i in range(1, 26)]].values
+write_fcst_file(corrected_file_path, corrected_data['date'].to_numpy(dtype=str), corrected_data['lead_time'].values,
+                corrected_members, member_format='%.1f')
+# The written file must read back as the corrected forecasts
+check_fcst_file(corrected_file_path, reforecast_data['date'].values, corrected_data['lead_time'].values, corrected_members)
 
 print(f"Bias correction completed and saved to:", corrected_file_path)
 
@@ -495,6 +528,12 @@ import numpy as np
 from scipy.stats import gamma
 from statsmodels.tsa.arima.model import ARIMA
 import os
+import sys
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from fcst_writer import write_fcst_file, check_fcst_file
+from fcst_reader import read_fcst
+from observation_store import ObservationStore
 
 # Function to calculate CDF
 def calculate_cdf(data):
@@ -570,20 +609,18 @@ def bias_correction_segmented_qm(reforecast_data, rean_sorted, rean_cdf, obs_sor
 # Load the ensemble reforecast data
 file_path = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia\merged\Alazani Basin - Shakriani Hydrological Station_reforecast_efas_2006_2018.fcst'
 column_names = ["date", "lead_time"] + [f'ensemble_{i}' for i in range(1, 26)]
-usecols = list(range(27))  # Only read the first 27 columns
-reforecast_data = pd.read_csv(file_path, delim_whitespace=True, header=None, names=column_names, usecols=usecols)
-reforecast_data['date'] = pd.to_datetime(reforecast_data['date'], format='%Y%m%d%H')
+# Only the first 27 columns are read; parsed once, later runs memory-map the binary sidecar next to the .fcst
+reforecast_data = read_fcst(file_path, names=column_names, n_members=25)
 
 # Load observed and reanalysis data
 obs_file = r'C:\Users\dottacor\Documents2\GitFiles\Georgia_obs\Q-Alazani-Shaqriani.obs'
 reanalysis_file = r'C:\Users\dottacor\Documents2\GitFiles\EFAS_Georgia_historical\output\discharge_data_1991_2018.txt'
+obs_store_dir = r'C:\Users\dottacor\Documents2\GitFiles\obs_store'  # Shared by every station, parsed once per text file version
 
-observed_data = pd.read_csv(obs_file, delim_whitespace=True, header=None, names=["date", "flow"])
-reanalysis_data = pd.read_csv(reanalysis_file, delim_whitespace=True, header=None, names=["date", "flow"])
-
-# Convert date columns to datetime
-observed_data['date'] = pd.to_datetime(observed_data['date'], format='%Y%m%d%H')
-reanalysis_data['date'] = pd.to_datetime(reanalysis_data['date'], format='%Y%m%d')
+# Both series come from the observation store, the text files are parsed again only when they change
+store = ObservationStore(obs_store_dir)
+observed_data = store.add('Q-Alazani-Shaqriani', obs_file, '%Y%m%d%H').frame('Q-Alazani-Shaqriani', ('date', 'flow'))
+reanalysis_data = store.add('Shakriani_EFAS_reanalysis', reanalysis_file, '%Y%m%d').frame('Shakriani_EFAS_reanalysis', ('date', 'flow'))
 
 # Set the date column as index for observed data
 observed_data.set_index('date', inplace=True)
@@ -617,8 +654,12 @@ corrected_dir = r'C:\Users\dottacor\Documents2\GitFiles\corrected'
 os.makedirs(corrected_dir, exist_ok=True)
 corrected_file_path = os.path.join(corrected_dir, 'corrected_reforecast_data_segmented_qm_arima.fcst')
 
-# Ensure the output format is consistent with the input format
-corrected_data.to_csv(corrected_file_path, index=False, sep=' ', header=False, float_format='%.1f')
+# Ensure the output format is consistent with the input format, dates as the yyyymmddhh strings formatted above
+corrected_members = corrected_data[[f'ensemble_{i}' for i in range(1, 26)]].values
+write_fcst_file(corrected_file_path, corrected_data['date'].to_numpy(dtype=str), corrected_data['lead_time'].values,
+                corrected_members, member_format='%.1f')
+# The written file must read back as the corrected forecasts
+check_fcst_file(corrected_file_path, reforecast_data['date'].values, corrected_data['lead_time'].values, corrected_members)
 
 print(f"Bias correction completed and saved to:", corrected_file_path)
 
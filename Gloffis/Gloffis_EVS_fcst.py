@@ -2,8 +2,16 @@
 #Takes output discharge from gloffis and formats into EVS format .fcst
 
 import pandas as pd
-import glob
+import fnmatch
 import os
+import sys
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from fcst_writer import write_fcst_file
 
 # Define input and output directories
 input_directory = r'C:\Users\dottacor\OneDrive - Stichting Deltares\Documents\Git\Msc-Thesis\GLOFFIS\Output'  # keep all the output files here
@@ -11,6 +19,7 @@ output_directory = r'C:\Users\dottacor\OneDrive - Stichting Deltares\Documents\G
 
 # Define the station code
 station_code = 'X007324'   # the one for Lobith
+max_workers = 8  # CSV files read at the same time
 
 # Define the range of months to process
 start_year = 1994
@@ -22,54 +31,76 @@ end_month = 7
 date_range = pd.date_range(start=f'{start_year}-{start_month:02d}', end=f'{end_year}-{end_month:02d}', freq='MS')
 date_range = [(date.year, date.month) for date in date_range]
 
+# Candidate formats of the 'GMT' column, the first that parses a file's first date is used for all of it
+date_formats = ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d', '%d-%m-%Y %H:%M:%S', '%d-%m-%Y %H:%M', '%d/%m/%Y %H:%M']
+
+def index_files(directory):
+    """
+    Scan the directory once and map (year, month) to its wflow forecast files, sorted by name.
+    """
+    files_by_month = defaultdict(list)
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name[:6].isdigit() and fnmatch.fnmatch(entry.name, '*_wflow_sbm_rhine_*_forecast_seas5_Q.csv'):
+                files_by_month[(int(entry.name[:4]), int(entry.name[4:6]))].append(entry.path)
+    return {key: sorted(paths) for key, paths in files_by_month.items()}
+
+def sniff_date_format(value):
+    for date_format in date_formats:
+        try:
+            datetime.strptime(value, date_format)
+            return date_format
+        except ValueError:
+            continue
+    return None
+
+def read_forecast_file(file):
+    """
+    Read 'GMT' and the station's columns of one wflow CSV, with the dates formatted as yyyymmddhh.
+    """
+    # Sniff the header so only the needed columns are parsed
+    with open(file, 'r') as f:
+        header = f.readline().rstrip('\r\n').split(',')
+    columns_to_keep = ['GMT'] + [col for col in header if station_code in col]
+
+    # Read as text, the members are written as they appear in the CSV
+    df = pd.read_csv(file, usecols=columns_to_keep, dtype=str)[columns_to_keep]
+
+    # Delete the first row
+    df = df.iloc[1:].reset_index(drop=True)
+
+    # Convert the 'GMT' column to datetime with one fixed format and format it to 'yyyymmddhh'
+    date_format = sniff_date_format(df['GMT'].iloc[0]) if len(df) else None
+    df['GMT'] = pd.to_datetime(df['GMT'], format=date_format).dt.strftime('%Y%m%d%H')
+
+    # Insert the 'leadtime' column
+    df.insert(1, 'leadtime', range(24, 24 * (len(df) + 1), 24))
+    return df
+
+# One directory scan instead of a glob per month
+files_by_month = index_files(input_directory)
+
 # Initialize an empty list to store the dataframes for the final combined output
 final_df_list = []
 
-# Loop over each (year, month) in the date range
-for year, month in date_range:
-    # Pattern to match the required files for the specific year and month
-    file_pattern = os.path.join(input_directory, f'{year}{month:02d}*_wflow_sbm_rhine_*_forecast_seas5_Q.csv')
-
-    # List of all matching files
-    files = glob.glob(file_pattern)
-
-    # Initialize an empty list to store the dataframes for the current month
-    df_list = []
-
-    # Loop through each file and process it
-    for file in files:
-        # Read the CSV file
-        df = pd.read_csv(file)
-        
-        # Keep the first column and columns that have the code 'X007324'
-        columns_to_keep = ['GMT'] + [col for col in df.columns if station_code in col]
-        df = df[columns_to_keep]
-        
-        # Delete the first row
-        df = df.iloc[1:].reset_index(drop=True)
-        
-        # Convert the 'GMT' column to datetime format
-        df['GMT'] = pd.to_datetime(df['GMT'], infer_datetime_format=True)
-        
-        # Format the 'GMT' column to 'yyyymmddhh'
-        df['GMT'] = df['GMT'].dt.strftime('%Y%m%d%H')
-        
-        # Insert the 'leadtime' column
-        df.insert(1, 'leadtime', range(24, 24 * (len(df) + 1), 24))
-        
-        # Append the processed dataframe to the list for the current month
-        df_list.append(df)
-
-    # Concatenate all dataframes for the current month  #No need to save
-    if df_list:
-        combined_df = pd.concat(df_list, ignore_index=True)
-
-        # Save the concatenated dataframe to a single .fcst file without the header
-        #output_file = os.path.join(output_directory, f'{year}{month:02d}_{station_code}_combined_output.fcst')
-        #combined_df.to_csv(output_file, index=False, header=False, sep=' ')
-
-        # Append the monthly combined dataframe to the final list
-        final_df_list.append(combined_df)
+with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    # Loop over each (year, month) in the date range
+    for year, month in date_range:
+        files = files_by_month.get((year, month), [])
+
+        # Read the files of the month in parallel, map keeps their order
+        df_list = list(executor.map(read_forecast_file, files))
+
+        # Concatenate all dataframes for the current month  #No need to save
+        if df_list:
+            combined_df = pd.concat(df_list, ignore_index=True)
+
+            # Save the concatenated dataframe to a single .fcst file without the header
+            #output_file = os.path.join(output_directory, f'{year}{month:02d}_{station_code}_combined_output.fcst')
+            #combined_df.to_csv(output_file, index=False, header=False, sep=' ')
+
+            # Append the monthly combined dataframe to the final list
+            final_df_list.append(combined_df)
 
 # Concatenate all the monthly combined dataframes into a single dataframe
 if final_df_list:
@@ -77,7 +108,9 @@ if final_df_list:
 
     # Save the final combined dataframe to a single .fcst file without the header
     final_output_file = os.path.join(output_directory, f'{station_code}_Q.fcst')
-    final_combined_df.to_csv(final_output_file, index=False, header=False, sep=' ')
+    # Members are written as read from the CSVs, missing values as empty fields like to_csv did
+    write_fcst_file(final_output_file, final_combined_df['GMT'].values, final_combined_df['leadtime'].values,
+                    final_combined_df.iloc[:, 2:].fillna('').values, member_format='%s')
 
 print("Processing completed and files saved successfully.")
 
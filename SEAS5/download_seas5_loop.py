@@ -3,11 +3,15 @@
 import datetime as dt
 from pathlib import Path
 import os
+import sys
 import logging
-import cdsapi
 
-# Initialize CDS API client
-c = cdsapi.Client()
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from download_manifest import DownloadManifest, MANIFEST_NAME, looks_complete
+from cds_client_pool import ClientPool, TELEMETRY_NAME
+
+DATASET = 'seasonal-original-single-levels'
 
 def download_data_for_month(year, month, deltat, my_variables, var_name_suffix):
     """
@@ -26,16 +30,27 @@ def download_data_for_month(year, month, deltat, my_variables, var_name_suffix):
         'leadtime_hour': list(range(0, 4320 + deltat, deltat))
     }
 
+    # Skip months finished in a previous run
+    if manifest.is_complete(final_file_name, DATASET, my_request):
+        logging.info(f"Already downloaded, skipping {var_name_suffix} data: {day0_str}")
+        return
+
     logging.info(f"Starting download for {var_name_suffix} data: {day0_str}")
-    c.retrieve('seasonal-original-single-levels', my_request, target_file_tmp)
+    pool.retrieve(DATASET, my_request, target_file_tmp)
 
     # Check if the download was successful and the file exists before renaming
     if os.path.exists(target_file_tmp):
         try:
-            os.rename(target_file_tmp, final_file_name)
+            os.replace(target_file_tmp, final_file_name)
             logging.info(f"File successfully renamed to {final_file_name}")
         except OSError as e:
             logging.error(f"Error renaming file from {target_file_tmp} to {final_file_name}: {e}")
+            return
+        # Only record complete GRIB files, a truncated one is fetched again on the next run
+        if looks_complete(final_file_name):
+            manifest.record(final_file_name, DATASET, my_request)
+        else:
+            logging.error(f"Downloaded file is truncated: {final_file_name}")
     else:
         logging.error(f"Download failed or file does not exist: {target_file_tmp}")
 
@@ -57,6 +72,12 @@ end_month = int(input("Enter the end month (1-12): "))
 # Folder where files will be saved
 import_folder = my_path
 
+# Record of finished downloads, lets a rerun skip finished months
+manifest = DownloadManifest(import_folder / MANIFEST_NAME)
+
+# Initialize CDS API client, every request is timed in the telemetry log
+pool = ClientPool(1, import_folder / TELEMETRY_NAME)
+
 # Loop through each year and month
 for year in range(start_year, end_year + 1):
     for month in range(start_month, end_month + 1):
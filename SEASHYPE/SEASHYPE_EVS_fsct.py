@@ -4,71 +4,69 @@
 import numpy as np
 import pandas as pd
 import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from time_axis import format_dates
+from fcst_writer import write_fcst_file
+
 
 #%% Define paths
 base_path = r"C:\Users\dottacor\OneDrive - Stichting Deltares\Documents\Git\Msc-Thesis\SEASHYPE\SEASHYPE_reforecast_data"
+max_workers = 8  # Member files of a month read at the same time
 
 #%% Function to read and process individual ensemble file
 def process_ensemble_file(file_path, ensemble_number):
     try:
-        # Read the data, using space as the delimiter and skip only the first line (assuming it's the header)
-        data = pd.read_csv(file_path, sep='\s+', skiprows=1, engine='python')
-        # Convert 'DATE' to datetime, then to string in the format 'YYYYMMDD00'
-        data['DATE'] = pd.to_datetime(data.iloc[:, 0], format='%Y-%m-%d', errors='coerce').dt.strftime('%Y%m%d00')
-        if data['DATE'].isna().any():
+        # Parse only the date and the 6th data column (column index 5), with the C parser;
+        # skip only the first line (assuming it's the header)
+        data = pd.read_csv(file_path, sep=r'\s+', skiprows=1, usecols=[0, 5], engine='c')
+        dates = pd.to_datetime(data.iloc[:, 0], format='%Y-%m-%d', errors='coerce')
+        if dates.isna().any():
             print(f"Failed to convert some 'DATE' entries to datetime in {file_path}")
             return None
-        # Ensure we are selecting the 6th data column (column index 5, as indexing starts at 0)
+        # Dates as strings in the format 'YYYYMMDD00', formatted in bulk
         output_column_name = f"data_{ensemble_number:02d}"
-        data = data.iloc[:, [0, 5]].rename(columns={data.columns[5]: output_column_name})
-        return data
+        return pd.DataFrame({'DATE': format_dates(dates.to_numpy()), output_column_name: data.iloc[:, 1].to_numpy()})
     except Exception as e:
         print(f"Failed to process {file_path}: {e}")
         return None
 
+#%% Function to load the 25 ensemble files of a month concurrently
+def load_month(folder_path, year, month):
+    file_paths = [os.path.join(folder_path, f"{year}{month:02d}_{ensemble:02d}_COUT.txt") for ensemble in range(25)]  # Ensemble goes from 00 to 24
+    for file_path in file_paths:
+        if not os.path.exists(file_path):
+            print(f"File does not exist: {file_path}")
+
+    # The C parser releases the GIL while tokenizing, so threads overlap the reads; map keeps member order
+    existing = [(file_path, ensemble) for ensemble, file_path in enumerate(file_paths) if os.path.exists(file_path)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda args: process_ensemble_file(*args), existing)
+        return [result for result in results if result is not None]
+
 #%% Loop through years, months, and ensembles
 for year in range(1994, 2015):  # Modified the range to start from 1993
     start_month = 1  # Start from January
     for month in range(start_month, 13):  # Loop through all months
-        ensemble_data = []
         folder_path = os.path.join(base_path, f"{year}_SEASHYPE")
-        for ensemble in range(25):  # Ensemble goes from 00 to 24
-            file_name = f"{year}{month:02d}_{ensemble:02d}_COUT.txt"
-            file_path = os.path.join(folder_path, file_name)
-            if os.path.exists(file_path):
-                result = process_ensemble_file(file_path, ensemble)
-                if result is not None:
-                    ensemble_data.append(result)
-            else:
-                print(f"File does not exist: {file_path}")
+        ensemble_data = load_month(folder_path, year, month)
 
         if ensemble_data:
-            # Concatenate data horizontally, align by 'DATE'
-            combined_data = pd.concat(ensemble_data, axis=1)
-            # Ensure no duplicated 'DATE' columns remain
-            combined_data = combined_data.loc[:, ~combined_data.columns.duplicated(keep='first')]
-
-            # Add a new column starting with 24 and increasing by 24 for each row
-            new_column_values = np.arange(24, 24 * len(combined_data) + 1, 24)
-            combined_data.insert(1, 'New_Column', new_column_values, True)
-
-            # Round the values in the third column until the last one to three decimal places and add trailing zeros
-            for column in combined_data.columns[2:]:
-                combined_data[column] = combined_data[column].round(3).apply(lambda x: "{:.3f}".format(x))
+            # Concatenate data horizontally, aligned by row, into one float matrix of members
+            combined_data = pd.concat([member.iloc[:, 1] for member in ensemble_data], axis=1)
+            members = np.round(combined_data.to_numpy(dtype=float), 3)
+            # Dates as YYYYMMDD0000, the layout the SEASHYPE visualisations parse
+            dates = np.char.add(ensemble_data[0]['DATE'].reindex(combined_data.index).to_numpy(dtype=str), '00')
+            # Lead times start at 24 and increase by 24 for each row
+            leadtimes = np.arange(24, 24 * len(combined_data) + 1, 24)
 
-            # Save the processed data to a new file with header but without column names
+            # Format in bulk and write the final headerless file in one pass
             output_file = os.path.join(folder_path, f"{year}{month:02d}_COUT.fcst")
-            # Convert date format to YYYYMMDD00 without hyphens
-            combined_data.iloc[:, 0] = combined_data.iloc[:, 0].str.replace('-', '') + '00'
-            combined_data.to_csv(output_file, index=False, sep='\t', header=True, lineterminator='\n', encoding='utf-8')
-            # Remove column names from the file
-            with open(output_file, 'r+', encoding='utf-8') as file:
-                lines = file.readlines()
-                file.seek(0)
-                file.writelines(lines[1:])
-                file.truncate()
+            write_fcst_file(output_file, dates, leadtimes, members, member_format='%.3f', sep='\t')
             print(f"Data for {year}-{month:02d} processed and saved to {output_file}")
         else:
             print(f"No ensemble data collected for {year}-{month:02d}")
@@ -1,48 +1,77 @@
 #%% Developed by Deborah Dotta, May 2024
 
 import os
-import pandas as pd
+import shutil
 
 # Define base directory
 base_directory = r"C:\Users\dottacor\OneDrive - Stichting Deltares\Documents\Git\Msc-Thesis\SEASHYPE\SEASHYPE_reforecast_data"
+buffer_size = 16 * 1024 * 1024  # Bytes per read/write when zero-copy transfer is not available
 
-# Initialize an empty list to store the dataframes for the entire period
-all_dataframes = []
+#%% Functions to order the joined files and copy their bytes
+def first_row(file_path):
+    """
+    First line of a .fcst file split into fields, or None for an empty file.
+    """
+    with open(file_path, 'rb') as f:
+        line = f.readline()
+    return line.split() or None
 
-# Iterate over each folder within the base directory
+def append_file(src, dst):
+    """
+    Copy the rest of src to dst, with os.sendfile where the OS supports it (Linux), else in large chunks.
+    """
+    if hasattr(os, 'sendfile'):
+        dst.flush()
+        offset, size = src.tell(), os.fstat(src.fileno()).st_size
+        try:
+            while offset < size:
+                sent = os.sendfile(dst.fileno(), src.fileno(), offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            dst.seek(0, os.SEEK_END)
+            return
+        except OSError:
+            src.seek(offset)  # Fall back to copying from where sendfile stopped
+    shutil.copyfileobj(src, dst, buffer_size)
+
+#%% Collect the joined .fcst files of every folder and order them by forecast init date
+joined_files = []
 for folder_to_process in os.listdir(base_directory):
     folder_path = os.path.join(base_directory, folder_to_process)
     
     # Check if the item in the base directory is a folder
     if os.path.isdir(folder_path):
-        # Initialize an empty list to store the dataframes for the current folder
-        dataframes = []
-        
-        # Traverse through all files in the specified folder
         for file in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, file)
             # Check if the file is a joined .fcst file
             if file.endswith("_joined.fcst"):
-                # Read the joined .fcst file into a dataframe
-                df = pd.read_csv(file_path, sep='\t', header=None)
-                # Append the dataframe to the list for the current folder
-                dataframes.append(df)
-        
-        # Concatenate all dataframes vertically into one for the current folder
-        if dataframes:
-            combined_df_folder = pd.concat(dataframes, axis=0, ignore_index=True)
-            # Append the concatenated dataframe of the current folder to the list for the entire period
-            all_dataframes.append(combined_df_folder)
-
-# Concatenate all dataframes vertically into one for the entire period
-if all_dataframes:
-    final_combined_df = pd.concat(all_dataframes, axis=0, ignore_index=True)
-    # Write the combined dataframe to a new .fcst file for the entire period
+                file_path = os.path.join(folder_path, file)
+                fields = first_row(file_path)
+                if fields is None:
+                    print(f"Skipping empty file {file_path}")
+                    continue
+                # The first date of a file is its first forecast day, which orders the init dates
+                joined_files.append((fields[0].decode(), len(fields), file_path))
+
+joined_files.sort()
+
+#%% Stream the files into one .fcst, memory use does not depend on the size of the period
+if joined_files:
     output_file = os.path.join(base_directory, "whole_period_joined.fcst")
-    final_combined_df.to_csv(output_file, index=False, sep='\t', header=False)
+    n_fields = joined_files[0][1]
+    with open(output_file, 'wb') as out:
+        for init_date, file_fields, file_path in joined_files:
+            if file_fields != n_fields:
+                print(f"Warning: {file_path} has {file_fields} columns instead of {n_fields}")
+            with open(file_path, 'rb') as src:
+                append_file(src, out)
+                # Keep row boundaries: a file without a final newline would merge its last row with the next file's first
+                src.seek(-1, os.SEEK_END)
+                if src.read(1) != b'\n':
+                    print(f"Warning: {file_path} does not end with a newline, one was added")
+                    out.write(b'\n')
     print(f"All data combined for the whole period and saved to {output_file}")
 else:
     print("No joined .fcst files found in the folders.")
 
 #%%
-
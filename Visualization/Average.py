@@ -3,26 +3,23 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
 
 # Define file paths
 obs_file_path = r"C:\Users\dottacor\evs-SEASHYPE\obs\9503451_Q_SEASHYPE2.obs"
 output_dir = r"C:\Users\dottacor\Documents2\GitFiles\Visualization_plots\Netherlands"
+obs_store_dir = r"C:\Users\dottacor\Documents2\GitFiles\obs_store"  # Shared by every station, parsed once per text file version
 
-# Read the observational data into a pandas DataFrame
-df_obs = pd.read_csv(obs_file_path, delim_whitespace=True, header=None)
-df_obs.columns = ['Date', 'Value']
-
-# Convert Date column to datetime
-df_obs['Date'] = pd.to_datetime(df_obs['Date'], format='%Y%m%d')
-
-# Filter data to include only the years from 1901 to 2020
-df_obs = df_obs[(df_obs['Date'].dt.year >= 2003) & (df_obs['Date'].dt.year <= 2003)]
+# Read the observational data from the observation store, the .obs is parsed again only when it changes
+store = ObservationStore(obs_store_dir).add('9503451_Q_SEASHYPE2', obs_file_path, '%Y%m%d')
 
-# Extract month from Date
-df_obs['Month'] = df_obs['Date'].dt.month
-
-# Group by Month and calculate the mean value
-monthly_avg = df_obs.groupby('Month')['Value'].mean().reset_index()
+# Monthly means of the year 2003, vectorized by the store
+monthly_avg = store.resample('9503451_Q_SEASHYPE2', 'M', 'mean', start='2003-01-01', end='2003-12-31')
+monthly_avg = pd.DataFrame({'Month': monthly_avg.index.month, 'Value': monthly_avg.values})
 
 # Map month numbers to month names
 month_names = {1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'}
@@ -92,19 +89,21 @@ plt.show()
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import sys
 from matplotlib.dates import DateFormatter, DayLocator
 import numpy as np
 
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
+
 # Define file paths
 obs_file_path = r"C:\Users\dottacor\evs-SEASHYPE\obs\9503451_Q_SEASHYPE2.obs"
 output_dir = r"C:\Users\dottacor\Documents2\GitFiles\Visualization_plots\Netherlands"
+obs_store_dir = r"C:\Users\dottacor\Documents2\GitFiles\obs_store"  # Shared by every station, parsed once per text file version
 
-# Read the observational data into a pandas DataFrame
-df_obs = pd.read_csv(obs_file_path, delim_whitespace=True, header=None)
-df_obs.columns = ['Date', 'Value']
-
-# Convert Date column to datetime
-df_obs['Date'] = pd.to_datetime(df_obs['Date'], format='%Y%m%d')
+# Read the observational data from the observation store, the .obs is parsed again only when it changes
+df_obs = ObservationStore(obs_store_dir).add('9503451_Q_SEASHYPE2', obs_file_path, '%Y%m%d').frame('9503451_Q_SEASHYPE2', ('Date', 'Value'))
 
 # Thresholds for April to September
 thresholds = {
@@ -3,29 +3,20 @@ import pandas as pd
 import os
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from ensemble_cube import load_cube
+from processed_cache import ProcessedCache
 
 # Define file paths
 data_file_path = r"C:\Users\dottacor\Documents2\GitFiles\SEASHYPE_reforecast_data\TheNetherlands\whole_period_joined.fcst"
-pickle_file_path = r"C:\Users\dottacor\Documents2\GitFiles\SEASHYPE_reforecast_data\TheNetherlands\processed_data.pkl"
-
-#%% Read and process data if pickle file doesn't exist
-if not os.path.exists(pickle_file_path):
-    # Read the data into a pandas DataFrame
-    df = pd.read_csv(data_file_path, delim_whitespace=True, header=None)
-    df.columns = ['Date', 'Leadtime'] + [f'Member_{i}' for i in range(1, 26)]
-
-    # Convert Date column to datetime
-    df['Date'] = pd.to_datetime(df['Date'], format='%Y%m%d%H%M')
-
-    # Save the processed DataFrame to a pickle file
-    with open(pickle_file_path, 'wb') as f:
-        pickle.dump(df, f)
+cache_dir = r"C:\Users\dottacor\Documents2\GitFiles\processed_cache"  # Shared by every station and forecast system, size-bounded
+member_columns = [f'Member_{i}' for i in range(1, 26)]
 
-else:
-    # Load the processed DataFrame from the pickle file
-    with open(pickle_file_path, 'rb') as f:
-        df = pickle.load(f)
+#%% Load the forecasts as an ensemble cube, kept in the shared processed-data cache and rebuilt when the .fcst changes
+cube = load_cube(data_file_path, date_format='%Y%m%d%H%M', cache=ProcessedCache(cache_dir))
 
 #%% Specify start date, leadtime, number of days to display, and tick interval
 start_date = '2013-04-01 00:00'
@@ -33,43 +24,35 @@ start_leadtime = 24
 num_days = 211  # Number of days to display
 tick_interval_days = 30  # Interval for x-axis ticks in days
 
-# Filter data to include only the specified start date and lead time
-df_start = df[(df['Date'] == start_date) & (df['Leadtime'] == start_leadtime)]
-
-if df_start.empty:
+# Look up the forecast of the specified start date and take num_days lead times from the start lead time
+try:
+    leads, members = cube.trace(start_date, start_leadtime, num_days)
+except KeyError:
     raise ValueError("No data found for the specified start date and lead time")
 
 # Debug: Print start index details
-print("Start Date and Leadtime:", df_start)
-
-# Get the index of the starting point
-start_index = df_start.index[0]
+print("Start Date and Leadtime:", start_date, start_leadtime, "forecast", cube.index(start_date))
 
-# Calculate the end index based on the number of days to display (each day corresponds to 24 hours lead time)
-end_index = start_index + num_days
-
-# Filter data for the specified range
-df_filtered = df.iloc[start_index:end_index]
+# Filtered data for the specified range
+df_filtered = pd.DataFrame(members, columns=member_columns)
+df_filtered.insert(0, 'Leadtime', leads)
 
 # Debug: Print filtered data
 print("Filtered Data:\n", df_filtered.head(20))
 
-# Ensure only the required columns (Date, Leadtime, and Member_1 to Member_25) are used
-df_filtered = df_filtered[['Date', 'Leadtime'] + [f'Member_{i}' for i in range(1, 26)]]
-
-# Calculate percentiles and mean for each row (without grouping by Date)
-percentile_10 = df_filtered.apply(lambda x: np.percentile(x[2:], 10), axis=1)
-percentile_30 = df_filtered.apply(lambda x: np.percentile(x[2:], 30), axis=1)
-percentile_70 = df_filtered.apply(lambda x: np.percentile(x[2:], 70), axis=1)
-percentile_90 = df_filtered.apply(lambda x: np.percentile(x[2:], 90), axis=1)
-mean = df_filtered.apply(lambda x: np.mean(x[2:]), axis=1)
+# Calculate percentiles and mean for each row across the members
+percentile_10 = np.percentile(members, 10, axis=1)
+percentile_30 = np.percentile(members, 30, axis=1)
+percentile_70 = np.percentile(members, 70, axis=1)
+percentile_90 = np.percentile(members, 90, axis=1)
+mean = np.mean(members, axis=1)
 
 # Debug: Print calculated percentiles and mean
-print("Percentile 10:\n", percentile_10.head())
-print("Percentile 30:\n", percentile_30.head())
-print("Percentile 70:\n", percentile_70.head())
-print("Percentile 90:\n", percentile_90.head())
-print("Mean:\n", mean.head())
+print("Percentile 10:\n", percentile_10[:5])
+print("Percentile 30:\n", percentile_30[:5])
+print("Percentile 70:\n", percentile_70[:5])
+print("Percentile 90:\n", percentile_90[:5])
+print("Mean:\n", mean[:5])
 
 # Calculate the day range for the x-axis
 day_range = np.arange(0, len(df_filtered))
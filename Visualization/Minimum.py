@@ -2,30 +2,25 @@
 import pandas as pd
 import matplotlib.pyplot as plt
 import os
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from observation_store import ObservationStore
 
 # Define file paths
 obs_file_path = r"C:\Users\dottacor\evs-SEASHYPE\obs\9503451_Q_SEASHYPE2.obs"
 output_dir = r"C:\Users\dottacor\Documents2\GitFiles\Visualization_plots\Netherlands"
+obs_store_dir = r"C:\Users\dottacor\Documents2\GitFiles\obs_store"  # Shared by every station, parsed once per text file version
 
-# Read the observational data into a pandas DataFrame
-df_obs = pd.read_csv(obs_file_path, delim_whitespace=True, header=None)
-df_obs.columns = ['Date', 'Value']
-
-# Convert Date column to datetime
-df_obs['Date'] = pd.to_datetime(df_obs['Date'], format='%Y%m%d')
-
-# Filter data to include only the years 1901 to 2020
-df_obs = df_obs[(df_obs['Date'].dt.year >= 1901) & (df_obs['Date'].dt.year <= 2020)]
-
-# Extract year and month from Date
-df_obs['Year'] = df_obs['Date'].dt.year
-df_obs['Month'] = df_obs['Date'].dt.month
+# Read the observational data from the observation store, the .obs is parsed again only when it changes
+store = ObservationStore(obs_store_dir).add('9503451_Q_SEASHYPE2', obs_file_path, '%Y%m%d')
 
-# Group by Year and Month and calculate the minimum value for each month of each year
-monthly_min_each_year = df_obs.groupby(['Year', 'Month'])['Value'].min().reset_index()
+# Minimum value for each month of each year from 1901 to 2020, vectorized by the store
+monthly_min_each_year = store.resample('9503451_Q_SEASHYPE2', 'M', 'min', start='1901-01-01', end='2020-12-31')
 
 # Group by Month and calculate the average of the minimum values for each month across the years
-monthly_avg_min = monthly_min_each_year.groupby('Month')['Value'].mean().reset_index()
+monthly_avg_min = monthly_min_each_year.groupby(monthly_min_each_year.index.month).mean().rename_axis('Month').reset_index(name='Value')
 
 # Map month numbers to month names
 month_names = {1: 'Jan', 2: 'Feb', 3: 'Mar', 4: 'Apr', 5: 'May', 6: 'Jun', 7: 'Jul', 8: 'Aug', 9: 'Sep', 10: 'Oct', 11: 'Nov', 12: 'Dec'}
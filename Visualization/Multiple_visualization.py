@@ -4,28 +4,27 @@ import pandas as pd
 import os
 import matplotlib.pyplot as plt
 import numpy as np
-import pickle
+import sys
+
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from ensemble_cube import load_cube
+from processed_cache import ProcessedCache
 
 # Define file paths
 data_file_path = r"C:\Users\dottacor\Documents2\GitFiles\SEASHYPE_reforecast_data\TheNetherlands\whole_period_joined.fcst"
-pickle_file_path = r"C:\Users\dottacor\Documents2\GitFiles\SEASHYPE_reforecast_data\TheNetherlands\processed_data.pkl"
-
-# Read and process data if pickle file doesn't exist
-if not os.path.exists(pickle_file_path):
-    # Read the data into a pandas DataFrame
-    df = pd.read_csv(data_file_path, delim_whitespace=True, header=None)
-    df.columns = ['Date', 'Leadtime'] + [f'Member_{i}' for i in range(1, 26)]
+cache_dir = r"C:\Users\dottacor\Documents2\GitFiles\processed_cache"  # Shared by every station and forecast system, size-bounded
 
-    # Convert Date column to datetime
-    df['Date'] = pd.to_datetime(df['Date'], format='%Y%m%d%H%M')
+# Load the forecasts as an ensemble cube, kept in the shared processed-data cache and rebuilt when the .fcst changes
+cube = load_cube(data_file_path, date_format='%Y%m%d%H%M', cache=ProcessedCache(cache_dir))
 
-    # Save the processed DataFrame to a pickle file
-    with open(pickle_file_path, 'wb') as f:
-        pickle.dump(df, f)
-else:
-    # Load the processed DataFrame from the pickle file
-    with open(pickle_file_path, 'rb') as f:
-        df = pickle.load(f)
+# Look up the forecast of a start date, num_days lead times from the start lead time, as (lead, member)
+def forecast_trace(start_date, start_leadtime, num_days):
+    try:
+        leads, members = cube.trace(start_date, start_leadtime, num_days)
+    except KeyError:
+        raise ValueError("No data found for the specified start date and lead time")
+    return members
 
 # Define function to plot percentiles
 def plot_percentiles(start_date, ax):
@@ -33,33 +32,18 @@ def plot_percentiles(start_date, ax):
     num_days = 91  # Number of days to display
     tick_interval_days = 15  # Interval for x-axis ticks in days
 
-    # Filter data to include only the specified start date and lead time
-    df_start = df[(df['Date'] == start_date) & (df['Leadtime'] == start_leadtime)]
-
-    if df_start.empty:
-        raise ValueError("No data found for the specified start date and lead time")
-
-    # Get the index of the starting point
-    start_index = df_start.index[0]
-
-    # Calculate the end index based on the number of days to display (each day corresponds to 24 hours lead time)
-    end_index = start_index + num_days
-
-    # Filter data for the specified range
-    df_filtered = df.iloc[start_index:end_index]
+    # Forecast of the specified start date from the specified lead time, one slice of the cube
+    members = forecast_trace(start_date, start_leadtime, num_days)
 
-    # Ensure only the required columns (Date, Leadtime, and Member_1 to Member_25) are used
-    df_filtered = df_filtered[['Date', 'Leadtime'] + [f'Member_{i}' for i in range(1, 26)]]
-
-    # Calculate percentiles and mean for each row (without grouping by Date)
-    percentile_10 = df_filtered.apply(lambda x: np.percentile(x[2:], 10), axis=1)
-    percentile_30 = df_filtered.apply(lambda x: np.percentile(x[2:], 30), axis=1)
-    percentile_70 = df_filtered.apply(lambda x: np.percentile(x[2:], 70), axis=1)
-    percentile_90 = df_filtered.apply(lambda x: np.percentile(x[2:], 90), axis=1)
-    mean = df_filtered.apply(lambda x: np.mean(x[2:]), axis=1)
+    # Calculate percentiles and mean for each row across the members
+    percentile_10 = np.percentile(members, 10, axis=1)
+    percentile_30 = np.percentile(members, 30, axis=1)
+    percentile_70 = np.percentile(members, 70, axis=1)
+    percentile_90 = np.percentile(members, 90, axis=1)
+    mean = np.mean(members, axis=1)
 
     # Calculate the day range for the x-axis
-    day_range = np.arange(0, len(df_filtered))
+    day_range = np.arange(0, len(members))
 
     # Plot Percentiles and Mean
     ax.fill_between(day_range, percentile_30, percentile_70, color='skyblue', alpha=0.6, label='30-70th Percentile')
@@ -90,31 +74,16 @@ def plot_single_runs(start_date, ax):
     num_days = 91  # Number of days to display
     tick_interval_days = 15  # Interval for x-axis ticks in days
 
-    # Filter data to include only the specified start date and lead time
-    df_start = df[(df['Date'] == start_date) & (df['Leadtime'] == start_leadtime)]
-
-    if df_start.empty:
-        raise ValueError("No data found for the specified start date and lead time")
-
-    # Get the index of the starting point
-    start_index = df_start.index[0]
-
-    # Calculate the end index based on the number of days to display (each day corresponds to 24 hours lead time)
-    end_index = start_index + num_days
-
-    # Filter data for the specified range
-    df_filtered = df.iloc[start_index:end_index]
-
-    # Ensure only the required columns (Date, Leadtime, and Member_1 to Member_25) are used
-    df_filtered = df_filtered[['Date', 'Leadtime'] + [f'Member_{i}' for i in range(1, 26)]]
+    # Forecast of the specified start date from the specified lead time, one slice of the cube
+    members = forecast_trace(start_date, start_leadtime, num_days)
 
     # Calculate the day range for the x-axis
-    day_range = np.arange(0, len(df_filtered))
+    day_range = np.arange(0, len(members))
 
     # Plot Single Runs with Colorful Lines
     colors = plt.cm.get_cmap('tab20', 25)
     for member in range(1, 26):
-        ax.plot(day_range, df_filtered[f'Member_{member}'], color=colors(member-1), linewidth=1)
+        ax.plot(day_range, members[:, member - 1], color=colors(member-1), linewidth=1)
 
     # Add labels and title
     ax.set_xlabel('Time (days)', fontsize=12)
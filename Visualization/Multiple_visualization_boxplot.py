@@ -1,39 +1,39 @@
 #%% Developed by Deborah Dotta, July 2024
 import pandas as pd
+import numpy as np
+import os
+import sys
 import matplotlib.pyplot as plt
 from matplotlib.ticker import FuncFormatter
 from matplotlib.lines import Line2D
 from calendar import monthrange
 
+# Shared helpers live in the Common folder at the repository root
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)) if '__file__' in globals() else '.', '..', 'Common'))
+from ensemble_cube import load_cube
+from processed_cache import ProcessedCache
+from observation_store import ObservationStore, resample_series
+
 # Load the forecast data
 forecast_file_path = 'C:/Users/dottacor/Documents2/GitFiles/SEASHYPE_reforecast_data/Georgia/forecast.fcst'
 obs_file_path = 'C:/Users/dottacor/Documents2/GitFiles/Georgia_obs/Q-Alazani-Shaqriani_monthly.obs'
+cache_dir = 'C:/Users/dottacor/Documents2/GitFiles/processed_cache'  # Shared by every station and forecast system, size-bounded
+obs_store_dir = 'C:/Users/dottacor/Documents2/GitFiles/obs_store'  # Shared by every station, parsed once per text file version
 
-# Read the forecast data
-df = pd.read_csv(forecast_file_path, delim_whitespace=True, header=None)
-df.columns = ['date', 'leadtime'] + [f'ensemble_{i}' for i in range(1, 26)]
-
-# Convert date to datetime format
-df['date'] = pd.to_datetime(df['date'], format='%Y%m%d')
+# Read the forecast data as an ensemble cube, kept in the shared processed-data cache and rebuilt when the .fcst changes
+cube = load_cube(forecast_file_path, date_format='%Y%m%d', cache=ProcessedCache(cache_dir))
 
-# Load the observed monthly data
-obs_data = pd.read_csv(obs_file_path, delim_whitespace=True, header=None, names=['date', 'discharge'])
-obs_data['date'] = pd.to_datetime(obs_data['date'], format='%Y%m%d')
-obs_data.set_index('date', inplace=True)
+# Load the observed monthly data from the observation store, the .obs is parsed again only when it changes
+obs_data = ObservationStore(obs_store_dir).add('Q-Alazani-Shaqriani_monthly', obs_file_path, '%Y%m%d').get('Q-Alazani-Shaqriani_monthly')
 
 # Remove invalid discharge values
-obs_data = obs_data[obs_data['discharge'] >= 0]
-
-# Calculate volume (m³) from discharge (m³/s)
-def calculate_volume(row):
-    days_in_month = monthrange(row.name.year, row.name.month)[1]
-    seconds_in_month = days_in_month * 24 * 60 * 60
-    return row['discharge'] * seconds_in_month
+obs_data = obs_data[obs_data >= 0]
 
-obs_data['volume'] = obs_data.apply(calculate_volume, axis=1)
+# Calculate volume (m³) from discharge (m³/s), the seconds of every month at once
+obs_volume = obs_data * (obs_data.index.days_in_month * 24 * 60 * 60)
 
 # Aggregate observed data to monthly sums
-obs_monthly_sum = obs_data['volume'].resample('M').sum()
+obs_monthly_sum = resample_series(obs_volume, 'M', 'sum')
 
 # Function to format y-axis labels in millions
 def millions(x, pos):
@@ -56,11 +56,12 @@ flierprops = dict(markerfacecolor='#0059b3', marker='o', markersize=5, alpha=0.5
 # Generate boxplots for each starting month in 2000
 for i in range(12):
     forecast_start_date = pd.to_datetime(f'{year}0101', format='%Y%m%d') + pd.DateOffset(months=i)
-    filtered_df = df[(df['date'] == forecast_start_date) & (df['leadtime'] <= 7)]
+    # The forecast of this start date is one slice of the cube, empty if the date is missing
+    leads, members = cube.forecast(forecast_start_date) if forecast_start_date in cube else (np.empty(0), np.empty((0, 25)))
     
     data_to_plot = []
     for leadtime in range(1, 8):
-        data_for_leadtime = filtered_df[filtered_df['leadtime'] == leadtime].iloc[:, 2:].values.flatten()
+        data_for_leadtime = members[leads == leadtime].flatten()
         days_in_month = monthrange(year, forecast_start_date.month)[1]
         data_to_plot.append(data_for_leadtime * (days_in_month * 24 * 60 * 60))  # Convert to volume
     